@@ -0,0 +1,191 @@
+"""
+Pack Aggregates
+
+Pack-wide and per-module max/min/avg values kept up to date as individual
+cell voltage and temperature readings arrive, one at a time or in batches
+(CAN ingestion applies each decoded batch with update_cell_voltages() and
+update_temps()). Pack-wide extremes live in
+segment trees (O(log n) per reading, O(1) to query, O(log n) to locate),
+averages in running sums, and per-module extremes are recomputed from the one
+module row that changed.
+
+Indices here are 0-based (module row, cell/sensor column), as in the
+PackState arrays.
+"""
+
+from typing import Callable, Tuple
+
+import numpy as np
+
+from pack_state import PackState
+
+
+class SegmentTree:
+    """Array-backed segment tree over a fixed number of values for max or min"""
+
+    def __init__(self, values: np.ndarray, func: Callable = max):
+        self.func = func
+        self._ufunc = np.maximum if func is max else np.minimum
+        self.identity = -np.inf if func is max else np.inf
+        self.n = len(values)
+        self.size = 1 << max(0, (self.n - 1).bit_length())
+        self.tree = np.full(2 * self.size, self.identity)
+        self.assign(values)
+
+    def assign(self, values: np.ndarray) -> None:
+        """Replace every value and rebuild the tree, one vectorized pass per level"""
+        tree = self.tree
+        tree[self.size:self.size + self.n] = values
+        lo, hi = self.size // 2, self.size
+        while lo >= 1:
+            self._ufunc(tree[2 * lo:2 * hi:2], tree[2 * lo + 1:2 * hi:2], out=tree[lo:hi])
+            lo, hi = lo // 2, lo
+
+    def update(self, index: int, value: float) -> None:
+        """Set one value and fix up its ancestors"""
+        tree = self.tree
+        func = self.func
+        pos = self.size + index
+        tree[pos] = value
+        pos >>= 1
+        while pos:
+            tree[pos] = func(tree[2 * pos], tree[2 * pos + 1])
+            pos >>= 1
+
+    def update_many(self, indices: np.ndarray, values: np.ndarray) -> None:
+        """Set several distinct values and fix up their ancestors, one vectorized pass per level"""
+        tree = self.tree
+        if len(indices) * 8 > self.n:
+            # Most of the tree is touched anyway; rebuilding every level is cheaper
+            tree[self.size + indices] = values
+            self.assign(tree[self.size:self.size + self.n].copy())
+            return
+        pos = self.size + indices
+        tree[pos] = values
+        pos = np.unique(pos >> 1)
+        while len(pos) and pos[-1] >= 1:
+            tree[pos] = self._ufunc(tree[2 * pos], tree[2 * pos + 1])
+            if pos[-1] == 1:
+                break
+            pos = np.unique(pos >> 1)
+
+    def top(self) -> float:
+        """Max (or min) of all values"""
+        return float(self.tree[1])
+
+    def top_index(self) -> int:
+        """Index of a value equal to top(), found by walking down from the root"""
+        tree = self.tree
+        pos = 1
+        while pos < self.size:
+            pos = 2 * pos if tree[2 * pos] == tree[pos] else 2 * pos + 1
+        return pos - self.size
+
+
+class PackAggregates:
+    """Incrementally maintained aggregates over a PackState's cells and temperatures"""
+
+    def __init__(self, state: PackState):
+        self.state = state
+        self.max_voltage = SegmentTree(state.cell_voltages.ravel(), max)
+        self.min_voltage = SegmentTree(state.cell_voltages.ravel(), min)
+        self.max_temp = SegmentTree(state.temps.ravel(), max)
+        self.module_voltage_sum = np.zeros(state.num_modules)
+        self.module_temp_sum = np.zeros(state.num_modules)
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """Recompute everything from the state, for when most readings changed at once"""
+        state = self.state
+        cells = state.cell_voltages
+        temps = state.temps
+        self.max_voltage.assign(cells.ravel())
+        self.min_voltage.assign(cells.ravel())
+        self.max_temp.assign(temps.ravel())
+
+        cells.sum(axis=1, out=self.module_voltage_sum)
+        temps.sum(axis=1, out=self.module_temp_sum)
+        cells.max(axis=1, out=state.module_max_voltage)
+        cells.min(axis=1, out=state.module_min_voltage)
+        temps.max(axis=1, out=state.module_max_temp)
+        np.divide(self.module_temp_sum, state.temps_per_module, out=state.module_avg_temp)
+        self.voltage_sum = float(self.module_voltage_sum.sum())
+        self.temp_sum = float(self.module_temp_sum.sum())
+
+    def update_cell_voltage(self, module: int, cell: int, value: float) -> None:
+        """Apply one cell voltage reading"""
+        state = self.state
+        row = state.cell_voltages[module]
+        delta = value - row[cell]
+        row[cell] = value
+        self.module_voltage_sum[module] += delta
+        self.voltage_sum += delta
+
+        index = module * state.cells_per_module + cell
+        self.max_voltage.update(index, value)
+        self.min_voltage.update(index, value)
+        state.module_max_voltage[module] = row.max()
+        state.module_min_voltage[module] = row.min()
+
+    def update_temp(self, module: int, sensor: int, value: float) -> None:
+        """Apply one temperature reading"""
+        state = self.state
+        row = state.temps[module]
+        delta = value - row[sensor]
+        row[sensor] = value
+        self.module_temp_sum[module] += delta
+        self.temp_sum += delta
+
+        self.max_temp.update(module * state.temps_per_module + sensor, value)
+        state.module_max_temp[module] = row.max()
+        state.module_avg_temp[module] = self.module_temp_sum[module] / state.temps_per_module
+
+    def update_cell_voltages(self, modules: np.ndarray, cells: np.ndarray, values: np.ndarray) -> None:
+        """Apply a batch of cell voltage readings, at most one per cell"""
+        state = self.state
+        state.cell_voltages[modules, cells] = values
+        index = modules * state.cells_per_module + cells
+        self.max_voltage.update_many(index, values)
+        self.min_voltage.update_many(index, values)
+        # Touched rows are re-summed rather than adjusted, so the sums don't drift
+        rows = np.unique(modules)
+        changed = state.cell_voltages[rows]
+        self.module_voltage_sum[rows] = changed.sum(axis=1)
+        state.module_max_voltage[rows] = changed.max(axis=1)
+        state.module_min_voltage[rows] = changed.min(axis=1)
+        self.voltage_sum = float(self.module_voltage_sum.sum())
+
+    def update_temps(self, modules: np.ndarray, sensors: np.ndarray, values: np.ndarray) -> None:
+        """Apply a batch of temperature readings, at most one per sensor"""
+        state = self.state
+        state.temps[modules, sensors] = values
+        self.max_temp.update_many(modules * state.temps_per_module + sensors, values)
+        rows = np.unique(modules)
+        changed = state.temps[rows]
+        self.module_temp_sum[rows] = changed.sum(axis=1)
+        state.module_max_temp[rows] = changed.max(axis=1)
+        state.module_avg_temp[rows] = self.module_temp_sum[rows] / state.temps_per_module
+        self.temp_sum = float(self.module_temp_sum.sum())
+
+    def module_avg_voltage(self) -> np.ndarray:
+        return self.module_voltage_sum / self.state.cells_per_module
+
+    def highest_cell(self) -> Tuple[int, int, float]:
+        """(module, cell, voltage) of the highest cell voltage in the pack"""
+        return divmod(self.max_voltage.top_index(), self.state.cells_per_module) + (self.max_voltage.top(),)
+
+    def lowest_cell(self) -> Tuple[int, int, float]:
+        """(module, cell, voltage) of the lowest cell voltage in the pack"""
+        return divmod(self.min_voltage.top_index(), self.state.cells_per_module) + (self.min_voltage.top(),)
+
+    def hottest_sensor(self) -> Tuple[int, int, float]:
+        """(module, sensor, temperature) of the hottest temperature sensor in the pack"""
+        return divmod(self.max_temp.top_index(), self.state.temps_per_module) + (self.max_temp.top(),)
+
+    def update_pack_fields(self) -> None:
+        """Fill the main page max/avg temp and max/min cell voltage fields"""
+        state = self.state
+        state.pack["max_temp"] = self.max_temp.top()
+        state.pack["avg_temp"] = self.temp_sum / state.temps.size
+        state.pack["max_cell_voltage"] = self.max_voltage.top()
+        state.pack["min_cell_voltage"] = self.min_voltage.top()
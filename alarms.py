@@ -0,0 +1,144 @@
+"""
+Alarm Engine
+
+Loads battery_limits.csv once into threshold arrays and classifies every
+signal in the pack (cell voltages, cell temperatures, module SOC and the
+pack-level current/voltage/SOC) in a single vectorized pass. The result feeds
+both the dashboard colours and the simulator's Module_Status bitmask.
+"""
+
+import csv
+from collections import defaultdict
+from typing import Dict, List, Mapping, Tuple
+
+import numpy as np
+
+from pack_state import PackState
+
+LIMITS_CSV = "./data/battery_limits.csv"
+
+# Alarm levels
+OK = 0
+WARNING = 1   # Orange
+CRITICAL = 2  # Red
+
+ALARM_COLORS = {
+    OK: (0, 255, 0),          # Green
+    WARNING: (255, 165, 0),   # Orange
+    CRITICAL: (255, 0, 0),    # Red
+}
+
+# Module_Status bits
+STATUS_OK = 1
+STATUS_HIGH_VOLTAGE = 2
+STATUS_LOW_VOLTAGE = 4
+STATUS_HIGH_TEMP = 8
+
+# Pack-level fields and the battery_limits.csv row that applies to them
+PACK_SIGNALS = (
+    ("current", "Current"),
+    ("total_voltage", "Total_Voltage"),
+    ("soc", "Module_SOC"),
+)
+
+
+def parse_module_limits(file_path: str) -> Dict[str, List[float]]:
+    """Read battery_limits.csv into {name: [upper_red, upper_orange, lower_red, lower_orange]}"""
+    limits_dict = defaultdict(list)
+    try:
+        with open(file_path, newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader)  # Skip header row
+            for row in reader:
+                if row:  # Check if row is not empty
+                    key = row[0].strip()
+                    values = [float(val.strip()) for val in row[1:] if val.strip()] # Mapped to: 'Upper_Red_Limit,Upper_Orange_Limit,Lower_Red_Limit,Lower_Orange_Limit'
+                    limits_dict[key].extend(values)
+    except FileNotFoundError:
+        print(f"Error: {file_path} not found")
+    except csv.Error as e:
+        print(f"Error parsing CSV file: {e}")
+    return limits_dict
+
+
+def alarm_color(level: int, ok_color: Tuple[int, int, int] = ALARM_COLORS[OK]) -> Tuple[int, int, int]:
+    """Display colour for an alarm level; some values show white rather than green when OK"""
+    return ok_color if level == OK else ALARM_COLORS[level]
+
+
+class PackAlarms:
+    """Alarm levels for every signal of one PackState"""
+
+    def __init__(self, cell_voltages: np.ndarray, temps: np.ndarray, module_soc: np.ndarray,
+                 pack: Dict[str, int], module_status: np.ndarray):
+        self.cell_voltages = cell_voltages
+        self.temps = temps
+        self.module_soc = module_soc
+        self.pack = pack
+        self.module_status = module_status
+
+
+class AlarmEngine:
+    """Vectorized limit checks driven by battery_limits.csv"""
+
+    def __init__(self, limits: Mapping[str, List[float]]):
+        # Signals without a complete limits row never alarm
+        no_limits = [np.inf, np.inf, -np.inf, -np.inf]
+        self.limits = {name: list(values) if len(values) == 4 else no_limits
+                       for name, values in limits.items()}
+        self._no_limits = no_limits
+        self._thresholds = {}  # (modules, cells, temps) -> (4, n) per-element limits
+
+    @classmethod
+    def from_csv(cls, file_path: str = LIMITS_CSV) -> "AlarmEngine":
+        return cls(parse_module_limits(file_path))
+
+    def limits_for(self, name: str) -> List[float]:
+        """[upper_red, upper_orange, lower_red, lower_orange] for one battery_limits.csv row"""
+        return self.limits.get(name, self._no_limits)
+
+    def _thresholds_for(self, pack: PackState) -> np.ndarray:
+        """Per-element thresholds matching the flattened signal layout used by evaluate()"""
+        key = (pack.num_modules, pack.cells_per_module, pack.temps_per_module)
+        thresholds = self._thresholds.get(key)
+        if thresholds is None:
+            rows = ([self.limits_for("Cell_Voltage")] * pack.cell_voltages.size
+                    + [self.limits_for("Cell_Temp")] * pack.temps.size
+                    + [self.limits_for("Module_SOC")] * pack.num_modules
+                    + [self.limits_for(limit) for _, limit in PACK_SIGNALS])
+            thresholds = np.array(rows, dtype=np.float64).T.copy()
+            self._thresholds[key] = thresholds
+        return thresholds
+
+    def evaluate(self, pack: PackState) -> PackAlarms:
+        """Classify every signal in the pack as OK, WARNING or CRITICAL"""
+        values = np.concatenate((
+            pack.cell_voltages.ravel(),
+            pack.temps.ravel(),
+            pack.module_soc,
+            [pack.pack[field] for field, _ in PACK_SIGNALS],
+        ))
+        upper_red, upper_orange, lower_red, lower_orange = self._thresholds_for(pack)
+
+        high = values > upper_orange
+        low = values < lower_orange
+        levels = (high | low).astype(np.uint8)  # WARNING
+        levels[(values > upper_red) | (values < lower_red)] = CRITICAL
+
+        # Split the flat result back into per-signal views
+        n_cells = pack.cell_voltages.size
+        n_temps = pack.temps.size
+        m = pack.num_modules
+        cell_levels = levels[:n_cells].reshape(pack.cell_voltages.shape)
+        temp_levels = levels[n_cells:n_cells + n_temps].reshape(pack.temps.shape)
+        soc_levels = levels[n_cells + n_temps:n_cells + n_temps + m]
+        pack_levels = {field: int(level) for (field, _), level in
+                       zip(PACK_SIGNALS, levels[n_cells + n_temps + m:])}
+
+        # Module_Status: any cell above/below the orange voltage limits, any sensor above the orange temp limit
+        status = np.full(m, STATUS_OK, dtype=np.uint8)
+        status[high[:n_cells].reshape(pack.cell_voltages.shape).any(axis=1)] |= STATUS_HIGH_VOLTAGE
+        status[low[:n_cells].reshape(pack.cell_voltages.shape).any(axis=1)] |= STATUS_LOW_VOLTAGE
+        status[high[n_cells:n_cells + n_temps].reshape(pack.temps.shape).any(axis=1)] |= STATUS_HIGH_TEMP
+
+        return PackAlarms(cell_levels, temp_levels, soc_levels, pack_levels, status)
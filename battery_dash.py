@@ -1,22 +1,46 @@
 import pygame
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 import csv
-
-pygame.init()
-
-window = pygame.display.set_mode((900,500))
-pygame.display.set_caption("Batteries Dash")
-clock = pygame.time.Clock()
+import math
+import os
+import time
+
+import numpy as np
+
+from alarms import LIMITS_CSV, AlarmEngine, alarm_color
+from glyph_atlas import atlas_for
+from instrumentation import profiler
+from pack_state import MAIN_PAGE_CSV, SNAPSHOT_FILE, PackState, load_topology, pack_csv_paths, read_snapshot
+from shared_buffer import ALARM_BUFFER_PATH, SHARED_BUFFER_PATH, SharedAlarmReader, SharedPackReader
+from telemetry_store import store
+from trends import TrendHistory, trend_points
+
+# The display is opened by init_display(), not on import, so the server,
+# supervisor and benchmarks can import this module without a window
+WINDOW_SIZE = (900, 500)
+window = None
+clock = None
 
 white = (255, 255, 255)
 black = (0, 0, 0)
 
-TOTAL_PAGES = 13
+# Page 0 is the pack overview, pages 1..num_modules one module each; the
+# topology comes from the pack being shown, pack_config.csv until one arrives
 MAIN_PAGE = 0
+ROWS_PER_PAGE = 11  # Cells/sensors shown at once on a module page, the rest scroll
+MODULE_JUMP = 10    # Modules skipped by SHIFT+LEFT/RIGHT
 
+# Frame scheduling: redraw as soon as new telemetry or input arrives, but no
+# faster than MAX_FPS; with nothing happening, wake IDLE_FPS times a second to
+# poll producers in other processes (shared memory buffer, snapshot files)
+MAX_FPS = 60
+IDLE_FPS = 5
+TELEMETRY_EVENT = pygame.event.custom_type()
 
-title_font = pygame.font.Font(None, 36)
-module_font = pygame.font.Font(None, 28)
+# Set by init_display(); fonts need pygame.font initialised
+title_font = None
+module_font = None
+trend_font = None
 
 # Dictionary of all text labels
 LABELS = {
@@ -31,27 +55,7 @@ LABELS = {
     'soc': "SOC:"
 }
 
-MODULES = {
-    1: "Module 1",
-    2: "Module 2",
-    3: "Module 3",
-    4: "Module 4",
-    5: "Module 5",
-    6: "Module 6",
-    7: "Module 7",
-    8: "Module 8",
-    9: "Module 9",
-    10: "Module 10",
-    11: "Module 11",
-    12: "Module 12",
-}
-
-
-voltages = 11
-temps = 8
 MODULE_LABELS = {
-    'voltages': [f'Voltage {i}:' for i in range(1, voltages + 1)],
-    'temps': [f'Temp {i}:' for i in range(1, temps + 1)],
     'soc': "SOC:",
     'max_voltage': "Max Voltage:",
     'min_voltage': "Min Voltage:",
@@ -60,36 +64,167 @@ MODULE_LABELS = {
     'avg_temp': "Avg Temp:",
     'state_of_charge': "State of Charge:"
 }
-# Pre-render all text surfaces
-main_menu_text = {key: module_font.render(text, True, white) for key, text in LABELS.items()}
-module_keys_text = {key: title_font.render(text, True, white) for key, text in MODULES.items()}
-module_text = {}
-
-for key, item in MODULE_LABELS.items():
-    if isinstance(item, list):
-        module_text[key] = [module_font.render(text, True, white) for text in item]
+# Labels are rendered on first use through render_text(), not up front
+
+
+# Rendered value surfaces, keyed by (font, text, colour), least recently used first
+TEXT_CACHE_SIZE = 4096
+text_cache = OrderedDict()
+
+def render_text(font, text, color):
+    key = (font, text, color)
+    surface = text_cache.get(key)
+    if surface is None:
+        start = profiler.start()
+        surface = font.render(text, True, color)
+        profiler.stop('text_render', start)
+        text_cache[key] = surface
+        if len(text_cache) > TEXT_CACHE_SIZE:
+            text_cache.popitem(last=False)
     else:
-        module_text[key] = module_font.render(item, True, white)
-
-
-def parse_module_limits(file_path):
-    limits_dict = defaultdict(list)
+        text_cache.move_to_end(key)
+    return surface
+
+
+class DirtyScreen:
+    """Redraws only the values whose text or colour changed since the last frame.
+
+    Static labels are drawn once per page; each value slot remembers what it
+    last showed and where, and a frame only updates the rects that changed.
+    """
+
+    def __init__(self, surface):
+        self.surface = surface
+        self.page = None
+        self.slots = {}  # slot key -> (text, color, rect)
+        self.dirty = []
+        self.full_redraw = True
+        self.use_atlas = True  # Draw numeric values from glyph atlases rather than font.render()
+
+    def invalidate(self):
+        self.page = None
+
+    def begin(self, page):
+        self.dirty = []
+        self.full_redraw = page != self.page
+        if self.full_redraw:
+            self.page = page
+            self.slots.clear()
+            self.surface.fill(black)
+
+    def blit_static(self, surface, rect):
+        if self.full_redraw:
+            self.surface.blit(surface, rect)
+
+    def draw_value(self, key, font, text, color, **position):
+        shown = self.slots.get(key)
+        if shown is not None and shown[0] == text and shown[1] == color:
+            return
+        # Numbers are copied glyph by glyph from an atlas; other text goes through the cache
+        atlas = atlas_for(font, color, black) if self.use_atlas else None
+        if atlas is not None and atlas.supports(text):
+            value_surface = None
+            rect = pygame.Rect(0, 0, atlas.width(text), atlas.height)
+            for name, value in position.items():
+                setattr(rect, name, value)
+        else:
+            value_surface = render_text(font, text, color)
+            rect = value_surface.get_rect(**position)
+        if shown is None:
+            self.dirty.append(rect)
+        elif value_surface is None and rect.contains(shown[2]):
+            # Atlas glyphs are opaque, so a value the same size or larger overwrites the old one
+            self.dirty.append(rect)
+        else:
+            self.surface.fill(black, shown[2])  # Erase the old value
+            self.dirty.append(shown[2].union(rect))
+        if value_surface is None:
+            atlas.draw(self.surface, text, rect.left, rect.top)
+        else:
+            self.surface.blit(value_surface, rect)
+        self.slots[key] = (text, color, rect)
+
+    def begin_area(self, key, version, rect):
+        # For graphics other than text: clear and redraw a rect only when its version changed
+        if self.slots.get(key) == version:
+            return False
+        self.surface.fill(black, rect)
+        self.dirty.append(rect)
+        self.slots[key] = version
+        return True
+
+    def end(self):
+        start = profiler.start()
+        if self.full_redraw:
+            pygame.display.update()
+        elif self.dirty:
+            pygame.display.update(self.dirty)
+        profiler.stop('display_update', start)
+
+screen = DirtyScreen(None)  # Surface set by init_display()
+
+def init_display(size=WINDOW_SIZE):
+    # Only the display and font modules: a full pygame.init() also brings up audio and joysticks
+    global window, clock, title_font, module_font, trend_font
+    if window is not None:
+        return window
+    pygame.display.init()
+    pygame.font.init()
+    window = pygame.display.set_mode(size)
+    pygame.display.set_caption("Batteries Dash")
+    clock = pygame.time.Clock()
+    title_font = pygame.font.Font(None, 36)
+    module_font = pygame.font.Font(None, 28)
+    trend_font = pygame.font.Font(None, 22)
+    screen.surface = window
+    screen.invalidate()
+    return window
+
+
+alarm_engine = None  # Loaded from battery_limits.csv on first use
+
+def get_alarm_engine():
+    global alarm_engine
+    if alarm_engine is None:
+        alarm_engine = AlarmEngine.from_csv(LIMITS_CSV)
+    return alarm_engine
+
+last_alarms = (None, None)  # (pack, PackAlarms) so each pack is evaluated once
+
+shm_frame = (None, 0)  # (pack, sequence) of the last frame read from the shared buffer
+alarm_reader = None
+
+def get_shared_alarms(pack):
+    # Alarms from the supervisor's alarm stage, if they were computed from this exact frame
+    global alarm_reader
+    if shm_frame[0] is not pack:
+        return None
+    if alarm_reader is None:
+        if not os.path.exists(ALARM_BUFFER_PATH):
+            return None
+        try:
+            alarm_reader = SharedAlarmReader(ALARM_BUFFER_PATH)
+        except (OSError, ValueError) as e:
+            print(f"Error mapping {ALARM_BUFFER_PATH}: {e}")
+            return None
     try:
-        with open(file_path, newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            next(reader)  # Skip header row
-            for row in reader:
-                if row:  # Check if row is not empty
-                    key = row[0].strip()
-                    values = [float(val.strip()) for val in row[1:] if val.strip()] # Mapped to: 'Upper_Red_Limit,Upper_Orange_Limit,Lower_Red_Limit,Lower_Orange_Limit'
-                    limits_dict[key].extend(values)
-    except FileNotFoundError:
-        print(f"Error: {file_path} not found")
-    except csv.Error as e:
-        print(f"Error parsing CSV file: {e}")
-    return limits_dict
-
-module_limits = parse_module_limits('./data/battery_limits.csv')
+        alarms, pack_sequence = alarm_reader.read()
+    except TimeoutError:
+        return None
+    if pack_sequence != shm_frame[1] or alarms.cell_voltages.shape != pack.cell_voltages.shape:
+        return None  # Alarm stage hasn't caught up with this frame
+    return alarms
+
+def get_alarms(pack):
+    global last_alarms
+    if last_alarms[0] is not pack:
+        alarms = get_shared_alarms(pack)
+        if alarms is None:
+            start = profiler.start()
+            alarms = get_alarm_engine().evaluate(pack)
+            profiler.stop('alarms', start)
+        last_alarms = (pack, alarms)
+    return last_alarms[1]
 
 def parse_module_data(file_path):
     data_dict = defaultdict(float)
@@ -109,6 +244,83 @@ def parse_module_data(file_path):
     return data_dict
             
 
+pack_topology = load_topology()  # (modules, cells, sensors) for sources that don't carry their own
+
+def parse_pack_data(file_paths):
+    # file_paths is main_page.csv followed by every module file, as from pack_csv_paths()
+    main_page_path, *module_paths = file_paths
+    _, cells_per_module, temps_per_module = pack_topology
+    pack = PackState(len(module_paths), cells_per_module, temps_per_module)
+    pack.load_main_page_dict(parse_module_data(main_page_path))
+    for module_num, module_path in enumerate(module_paths, start=1):
+        pack.load_module_dict(module_num, parse_module_data(module_path))
+    return pack
+
+shared_reader = None
+
+def get_shared_reader():
+    # Map the producer's shared memory buffer once it exists
+    global shared_reader
+    if shared_reader is None and os.path.exists(SHARED_BUFFER_PATH):
+        try:
+            shared_reader = SharedPackReader(SHARED_BUFFER_PATH)
+        except (OSError, ValueError) as e:
+            print(f"Error mapping {SHARED_BUFFER_PATH}: {e}")
+    return shared_reader
+
+def pack_source():
+    # Use whichever source the producer wrote most recently:
+    # the shared memory buffer, the atomic snapshot or the legacy CSV files
+    sources = []
+    reader = get_shared_reader()
+    if reader is not None:
+        sources.append((reader.timestamp(), SHARED_BUFFER_PATH, reader.read, ('shm', reader.sequence())))
+    for path, parser, stat_path in ((SNAPSHOT_FILE, read_snapshot, SNAPSHOT_FILE),
+                                    (pack_csv_paths(pack_topology[0]), parse_pack_data, MAIN_PAGE_CSV)):
+        try:
+            sources.append((os.stat(stat_path).st_mtime, path, parser, None))
+        except OSError:
+            pass
+    if not sources:
+        return pack_csv_paths(pack_topology[0]), parse_pack_data, None, 0.0
+    timestamp, path, parser, signature = max(sources, key=lambda source: source[0])
+    return path, parser, signature, timestamp
+
+replay_source = None  # Set when replaying a recording instead of showing live telemetry
+
+STALE_AFTER = 2.0  # Seconds without new data before the performance page flags it
+
+data_time = 0.0     # Wall-clock time the shown data was written by its producer
+data_version = 0    # Store version of the shown pack, to count updates never shown
+
+def get_pack_state():
+    global shm_frame, data_time, data_version
+    if replay_source is not None:
+        return replay_source.pack()
+    start = profiler.start()
+    path, parser, signature, data_time = pack_source()
+    try:
+        last_sequence = shm_frame[1]
+        pack, version = store.load('pack', path, parser, signature)
+        if signature is not None and signature[0] == 'shm':
+            shm_frame = (pack, shared_reader.last_sequence)
+            # Each frame advances the sequence by two
+            dropped = (shm_frame[1] - last_sequence) // 2 - 1 if last_sequence else 0
+        else:
+            dropped = version - data_version - 1 if data_version else 0
+        if version != data_version:
+            profiler.count('dropped_updates', max(0, dropped))
+            data_version = version
+    except (OSError, ValueError, IndexError, KeyError, TimeoutError) as e:
+        # A CSV caught mid-rewrite; keep showing the last good frame
+        print(f"Error reading pack data: {e}")
+        profiler.count('load_errors')
+        pack, _ = store.get('pack')
+        if pack is None:
+            pack = PackState(*pack_topology)  # Zeroed values until a frame has been read
+    profiler.stop('data_load', start)
+    return pack
+
 def get_csv(csv_path):
     try:
         with open(csv_path, newline='') as csvfile:
@@ -119,227 +331,454 @@ def get_csv(csv_path):
     except csv.Error as e:
         print(f"Error parsing CSV file: {e}")
 
-def render_main_page():
-        try: 
-            main_page_data = parse_module_data('./data/main_page.csv')
-        except:
-            main_page_data = defaultdict(float)
-
-        text_rect = main_menu_text['main_menu'].get_rect(midtop=(window.get_width()/2, 20))
-        window.blit(title_font.render("Batteries Dashboard:", True, white), text_rect)
+# Trend view: recent history of every signal, toggled with T
+TREND_COLORS = [
+    (0, 200, 255), (255, 99, 71), (50, 205, 50), (255, 215, 0), (238, 130, 238), (0, 255, 255),
+    (255, 140, 0), (173, 255, 47), (135, 206, 250), (255, 105, 180), (210, 180, 140),
+]
+grey = (90, 90, 90)
+trend_history = None
+last_trend_pack = None
+
+REPLAY_TREND_WINDOW = 3600.0  # Seconds of recording up to the playback position shown by replay trends
+
+def record_trend(pack):
+    # Append each new pack once, whatever page is showing, so every trend has history
+    global trend_history, last_trend_pack
+    if pack is last_trend_pack or replay_source is not None:
+        return  # Replay trends come from the recording itself
+    shape = (pack.num_modules, pack.cells_per_module, pack.temps_per_module)
+    if trend_history is None or trend_history.shape != shape:
+        trend_history = TrendHistory(*shape)
+    trend_history.append(pack)
+    last_trend_pack = pack
+
+def trend_range(limit_name):
+    # Fixed vertical scale: the red limits plus a small margin
+    upper_red, upper_orange, lower_red, lower_orange = get_alarm_engine().limits_for(limit_name)
+    margin = (upper_red - lower_red) * 0.05
+    return lower_red - margin, upper_red + margin
+
+def draw_trend(key, title, rect, names, limit_name):
+    low, high = trend_range(limit_name)
+    screen.blit_static(render_text(trend_font, title, white), (rect.left, rect.top - 18))
+    if not names:
+        # The scrolled-to rows are past this module's last cell or sensor
+        if screen.begin_area(key, 'no rows', rect):
+            hint = render_text(trend_font, "No rows on this page", grey)
+            window.blit(hint, hint.get_rect(center=rect.center))
+        return
+    screen.blit_static(render_text(trend_font, f"{high:.1f}", grey), (rect.left - 45, rect.top))
+    screen.blit_static(render_text(trend_font, f"{low:.1f}", grey), (rect.left - 45, rect.bottom - 14))
+    if replay_source is not None:
+        # Redrawn when playback has moved by a pixel's worth of time
+        end = replay_source.position()
+        version = ('replay', math.floor(end * rect.width / REPLAY_TREND_WINDOW))
+    elif trend_history is not None:
+        version = trend_history.appends
+    else:
+        return
+    if not screen.begin_area(key, version, rect):
+        return
+
+    pygame.draw.rect(window, grey, rect, 1)
+    # Orange limits as dim guide lines
+    _, upper_orange, _, lower_orange = get_alarm_engine().limits_for(limit_name)
+    for limit in (upper_orange, lower_orange):
+        if low < limit < high:
+            y = rect.bottom - 1 - (limit - low) * (rect.height - 1) / (high - low)
+            pygame.draw.line(window, (110, 70, 0), (rect.left, y), (rect.right - 1, y))
+
+    if replay_source is not None:
+        positions, mins, maxs = replay_trend(names, end, rect.width)
+    else:
+        positions, mins, maxs = trend_history.decimate(trend_history.columns(names), rect.width)
+    if len(positions) < 1:
+        return
+    for i in range(len(names)):
+        points = trend_points(positions, mins[:, i], maxs[:, i], rect.left, rect.top, rect.width, rect.height, low, high)
+        pygame.draw.lines(window, TREND_COLORS[i % len(TREND_COLORS)], False, points)
+
+def replay_trend(names, end, width):
+    # The hour before the playback position, from the recording's downsample pyramid,
+    # so the graph doesn't depend on what has been played back
+    start = end - REPLAY_TREND_WINDOW
+    series = [replay_source.recording.series(name, start, end, max_points=width) for name in names]
+    times = series[0][0]  # The same buckets for every signal of one recording
+    if not len(times):
+        empty = np.zeros((0, len(names)))
+        return np.zeros(0), empty, empty
+    mins = np.column_stack([low for _, low, _, _ in series])
+    maxs = np.column_stack([high for _, _, high, _ in series])
+    return (times - start) / REPLAY_TREND_WINDOW, mins, maxs
+
+def render_main_trends(pack):
+    main_title_text = render_text(title_font, LABELS['main_menu'], white)
+    screen.blit_static(main_title_text, main_title_text.get_rect(midtop=(window.get_width()/2, 20)))
+    graphs = [
+        ('current', "Current (A)", 'Current'),
+        ('total_voltage', "Total Voltage (V)", 'Total_Voltage'),
+        ('soc', "SOC (%)", 'Module_SOC'),
+    ]
+    for i, (field, title, limit_name) in enumerate(graphs):
+        rect = pygame.Rect(100, 85 + i * 135, window.get_width() - 150, 105)
+        draw_trend(('trend', field), title, rect, [field], limit_name)
+
+def render_module_trends(pack, module_key):
+    blit_module_title(module_key)
+    width = window.get_width() - 150
+    # Trends follow the cells and sensors scrolled into view on the module page
+    cells = [f"Module_{module_key}_Cell_{i + 1}_Voltage" for i in visible_rows(pack.cells_per_module)]
+    sensors = [f"Module_{module_key}_Temp_{i + 1}" for i in visible_rows(pack.temps_per_module)]
+    draw_trend(('trend', 'voltages'), "Cell Voltages (V)", pygame.Rect(100, 85, width, 180), cells, 'Cell_Voltage')
+    draw_trend(('trend', 'temps'), "Temperatures (°C)", pygame.Rect(100, 300, width, 180), sensors, 'Cell_Temp')
+
+def render_main_page(pack):
+        main_page_data = pack.pack
+        alarms = get_alarms(pack)
+
+        main_title_text = render_text(title_font, LABELS['main_menu'], white)
+        screen.blit_static(main_title_text, main_title_text.get_rect(midtop=(window.get_width()/2, 20)))
         # Left column text positioning with consistent rectangles
+        # (label, data key, unit, colour when within limits)
         main_menu_items = [
-            ('current', 'current', 'A'),
-            ('avg_temp', 'avg_temp', '°C'),
-            ('max_temp', 'max_temp', '°C'),
-            ('max_cell_voltage', 'max_cell_voltage', 'V'),
-            ('min_cell_voltage', 'min_cell_voltage', 'V'),
-            ('total_voltage', 'total_voltage', 'V'),
-            ('soc', 'soc', '%')
+            ('current', 'current', 'A', (0, 255, 0)),
+            ('avg_temp', 'avg_temp', '°C', white),
+            ('max_temp', 'max_temp', '°C', white),
+            ('max_cell_voltage', 'max_cell_voltage', 'V', white),
+            ('min_cell_voltage', 'min_cell_voltage', 'V', white),
+            ('total_voltage', 'total_voltage', 'V', white),
+            ('soc', 'soc', '%', (0, 255, 0))
         ]
 
-        for i, (label_key, data_key, unit) in enumerate(main_menu_items):
-            text = main_menu_text[label_key]
+        for i, (label_key, data_key, unit, ok_color) in enumerate(main_menu_items):
+            text = render_text(module_font, LABELS[label_key], white)
             rect = text.get_rect(left=50, top=100 + i * 50)  # Consistent 50px spacing
-            window.blit(text, rect)
+            screen.blit_static(text, rect)
              
             value = main_page_data.get(data_key, 0.0)  # Get value or default to 0.0
-
-            if label_key == 'current':
-                current_limits = module_limits.get('Current', 0.0)
-                upper_red_limit, upper_orange_limit, lower_red_limit, lower_orange_limit = current_limits
-                if value > upper_red_limit:
-                    color = (255, 0, 0)
-                elif value > upper_orange_limit:
-                    color = (255, 165, 0)
-                elif value < lower_red_limit:
-                    color = (255, 0, 0)
-                elif value < lower_orange_limit:
-                    color = (255, 165, 0)
-                else:
-                    color = (0, 255, 0)
-            elif label_key == 'total_voltage':
-                total_voltage_limits = module_limits.get('Total_Voltage', 0.0)
-                upper_red_limit, upper_orange_limit, lower_red_limit, lower_orange_limit = total_voltage_limits
-                
-                if value > upper_red_limit:
-                    color = (255, 0, 0)
-                elif value > upper_orange_limit:
-                    color = (255, 165, 0)
-                elif value < lower_red_limit:
-                    color = (255, 0, 0)
-                elif value < lower_orange_limit:
-                    color = (255, 165, 0)
-                else:
-                    color = (255, 255, 255)    
-            
-            elif label_key == 'soc':
-                soc_limits = module_limits.get('Module_SOC', 0.0)
-                upper_red_limit, upper_orange_limit, lower_red_limit, lower_orange_limit = soc_limits
-                
-                if label_key == 'state_of_charge' :
-                    if value > upper_red_limit:
-                        color = (255, 0, 0)
-                    elif value > upper_orange_limit:                         
-                        color = (255, 165, 0)
-                    elif value < lower_red_limit:                         
-                        color = (255, 0, 0)
-                    elif value < lower_orange_limit:
-                        color = (255, 165, 0)
-                    else:                                                              
-                        color = (0, 255, 0)
-            else:
-                color = (255, 255, 255)
-
-            value_surface = module_font.render(f"{value:.2f}{unit}", True, color)  
-            value_rect = value_surface.get_rect(left=rect.right + 10, top=rect.top)
-            window.blit(value_surface, value_rect)
-                
-
-
-def render_module(module_key):
-    # Get data for current module
-    try:
-        module_data = parse_module_data(f'./data/module_{module_key}_data.csv')  # Assuming this is your data file format
-    except:
-        module_data = defaultdict(float)  # Default values if file not found
-
-    module_title = module_keys_text[module_key].get_rect(midtop=(window.get_width()/2, 20))
-    window.blit(module_keys_text[module_key], module_title)
-
-    # Left column - Voltages
-    voltages_text = module_text['voltages']
-    for i in range(voltages):
+            # Values without limits (temps, cell voltages) have no alarm level
+            color = alarm_color(alarms.pack.get(data_key, 0), ok_color)
+
+            screen.draw_value(label_key, module_font, f"{value:.2f}{unit}", color, left=rect.right + 10, top=rect.top)
+
+        render_module_overview(pack, alarms)
+
+# Module overview on the main page: one tile per module in its worst alarm colour, click to open
+OVERVIEW_AREA = pygame.Rect(460, 100, 400, 340)
+MAX_TILE = 40
+
+def overview_layout(num_modules):
+    # (columns, tile size) that fit every module into OVERVIEW_AREA
+    columns = max(1, math.ceil(math.sqrt(num_modules * OVERVIEW_AREA.width / OVERVIEW_AREA.height)))
+    rows = math.ceil(num_modules / columns)
+    return columns, max(2, min(MAX_TILE, OVERVIEW_AREA.width // columns, OVERVIEW_AREA.height // rows))
+
+def overview_module_at(position, num_modules):
+    # Module key under a mouse position, or None
+    columns, size = overview_layout(num_modules)
+    x, y = position[0] - OVERVIEW_AREA.left, position[1] - OVERVIEW_AREA.top
+    if x < 0 or y < 0 or x >= columns * size:
+        return None
+    index = (y // size) * columns + x // size
+    return index + 1 if index < num_modules else None
+
+def render_module_overview(pack, alarms):
+    worst = np.maximum(alarms.cell_voltages.max(axis=1), alarms.temps.max(axis=1))
+    np.maximum(worst, alarms.module_soc, out=worst)
+    if not screen.begin_area('overview', worst.tobytes(), OVERVIEW_AREA):
+        return
+    columns, size = overview_layout(pack.num_modules)
+    for index, level in enumerate(worst.tolist()):
+        tile = pygame.Rect(OVERVIEW_AREA.left + (index % columns) * size, OVERVIEW_AREA.top + (index // columns) * size,
+                           size - 2, size - 2)
+        pygame.draw.rect(window, alarm_color(level), tile)
+        if size >= 24:
+            label = render_text(trend_font, str(index + 1), black)
+            window.blit(label, label.get_rect(center=tile.center))
+
+
+module_row_page = 0  # Which ROWS_PER_PAGE cells/sensors a module page shows
+
+def visible_rows(count):
+    first = min(module_row_page * ROWS_PER_PAGE, count)
+    return range(first, min(first + ROWS_PER_PAGE, count))
+
+def row_pages(pack):
+    return math.ceil(max(pack.cells_per_module, pack.temps_per_module) / ROWS_PER_PAGE)
+
+def blit_module_title(module_key):
+    title = render_text(title_font, f"Module {module_key}", white)
+    screen.blit_static(title, title.get_rect(midtop=(window.get_width()/2, 20)))
+
+def render_module(pack, module_key):
+    row = module_key - 1  # Module keys are 1-based, pack rows 0-based
+    alarms = get_alarms(pack)
+
+    blit_module_title(module_key)
+
+    # Left column - Voltages, coloured based on limits
+    for slot, i in enumerate(visible_rows(pack.cells_per_module)):
         # Render label
-        voltage_text = voltages_text[i]
-        voltage_rect = voltage_text.get_rect(left=50, top=75 + i * 35)
-        window.blit(voltage_text, voltage_rect)
+        voltage_text = render_text(module_font, f"Voltage {i + 1}:", white)
+        voltage_rect = voltage_text.get_rect(left=50, top=75 + slot * 35)
+        screen.blit_static(voltage_text, voltage_rect)
         
         # Render value
-        value = module_data.get(f'Cell_{i+1}_Voltage', 0.0)  # Get value or default to 0.0
-        cell_voltage_limits = module_limits.get('Cell_Voltage', 0.0)
-        upper_red_limit = cell_voltage_limits[0]
-        upper_orange_limit = cell_voltage_limits[1]
-        lower_red_limit = cell_voltage_limits[2]
-        lower_orange_limit = cell_voltage_limits[3]
-        # Color voltage values based on limits
-        if value > upper_red_limit:  # Upper red limit
-            value_surface = module_font.render(f"{value:.2f}V", True, (255, 0, 0))  # Red
-        elif value > upper_orange_limit:  # Upper orange limit
-            value_surface = module_font.render(f"{value:.2f}V", True, (255, 165, 0))  # Orange
-        elif value < lower_red_limit:  # Lower red limit
-            value_surface = module_font.render(f"{value:.2f}V", True, (255, 0, 0))  # Red
-        elif value < lower_orange_limit:  # Lower orange limit
-            value_surface = module_font.render(f"{value:.2f}V", True, (255, 165, 0))  # Orange
-        else:  # Within normal range
-            value_surface = module_font.render(f"{value:.2f}V", True, (0, 255, 0))  # Green
-        value_rect = value_surface.get_rect(left=voltage_rect.right + 10, top=voltage_rect.top)
-        window.blit(value_surface, value_rect)
+        value = pack.cell_voltages[row, i]
+        color = alarm_color(alarms.cell_voltages[row, i])
+        screen.draw_value(('voltage', slot), module_font, f"{value:.2f}V", color,
+                          left=voltage_rect.right + 10, top=voltage_rect.top)
     
     # Middle column - Temperatures
-    temps_text = module_text['temps']
-    cell_temp_limits = module_limits.get('Cell_Temp', 0.0)
-    upper_red_limit = cell_temp_limits[0]
-    upper_orange_limit = cell_temp_limits[1]
-    lower_red_limit = cell_temp_limits[2]
-    lower_orange_limit = cell_temp_limits[3]
-    for i in range(8):
+    for slot, i in enumerate(visible_rows(pack.temps_per_module)):
         # Render label
-        temp_text = temps_text[i]
-        temp_rect = temp_text.get_rect(midtop=(window.get_width()/2 - 50, 75 + i * 35))
-        window.blit(temp_text, temp_rect)
+        temp_text = render_text(module_font, f"Temp {i + 1}:", white)
+        temp_rect = temp_text.get_rect(midtop=(window.get_width()/2 - 50, 75 + slot * 35))
+        screen.blit_static(temp_text, temp_rect)
         
         # Render value
-        value = module_data.get(f'Temp_{i+1}', 0.0)
-        if value > upper_red_limit:  # Upper red limit
-            value_surface = module_font.render(f"{value:.2f}V", True, (255, 0, 0))  # Red
-        elif value > upper_orange_limit:  # Upper orange limit
-            value_surface = module_font.render(f"{value:.2f}V", True, (255, 165, 0))  # Orange
-        elif value < lower_red_limit:  # Lower red limit
-            value_surface = module_font.render(f"{value:.2f}V", True, (255, 0, 0))  # Red
-        elif value < lower_orange_limit:  # Lower orange limit
-            value_surface = module_font.render(f"{value:.2f}V", True, (255, 165, 0))  # Orange
-        else:  # Within normal range
-            value_surface = module_font.render(f"{value:.2f}V", True, (0, 255, 0))  # Green
-
-        value_rect = value_surface.get_rect(left=temp_rect.right + 10, top=temp_rect.top)
-        window.blit(value_surface, value_rect)
+        value = pack.temps[row, i]
+        color = alarm_color(alarms.temps[row, i])
+        screen.draw_value(('temp', slot), module_font, f"{value:.2f}°C", color,
+                          left=temp_rect.right + 10, top=temp_rect.top)
+
+    if row_pages(pack) > 1:
+        first = module_row_page * ROWS_PER_PAGE + 1
+        last = min(first + ROWS_PER_PAGE - 1, max(pack.cells_per_module, pack.temps_per_module))
+        # While replaying, UP/DOWN change playback speed instead
+        keys = "mouse wheel" if replay_source is not None else "UP/DOWN or mouse wheel"
+        hint = render_text(trend_font, f"Rows {first}-{last} of {max(pack.cells_per_module, pack.temps_per_module)}"
+                                       f" ({keys})", grey)
+        screen.blit_static(hint, hint.get_rect(left=50, bottom=window.get_height() - 10))
     
     # Right column - Stats
     right_column_x = window.get_width() - 100
     right_stats = [
-        ('state_of_charge', 'Module_SOC', '%'),
-        ('max_voltage', 'Module_Max_Voltage', 'V'),
-        ('min_voltage', 'Module_Min_Voltage', 'V'),
-        ('max_temp', 'Module_Max_Temp', '°C'),
-        ('avg_temp', 'Module_Avg_Temp', '°C')
+        ('state_of_charge', pack.module_soc, '%'),
+        ('max_voltage', pack.module_max_voltage, 'V'),
+        ('min_voltage', pack.module_min_voltage, 'V'),
+        ('max_temp', pack.module_max_temp, '°C'),
+        ('avg_temp', pack.module_avg_temp, '°C')
     ]
     
-    state_of_charge_threshold = module_limits.get('Module_SOC', 0.0)
-    for i, (label_key, data_key, unit) in enumerate(right_stats):
+    for i, (label_key, values, unit) in enumerate(right_stats):
         # Render label
-        stat_text = module_text[label_key]
+        stat_text = render_text(module_font, MODULE_LABELS[label_key], white)
         stat_rect = stat_text.get_rect(right=right_column_x, top=75 + i * 35)
-        window.blit(stat_text, stat_rect)
+        screen.blit_static(stat_text, stat_rect)
         
         # Render value
-        value = module_data.get(data_key, 0.0)
+        value = values[row]
         if label_key == 'state_of_charge' :
-            if value > state_of_charge_threshold[0]:
-                value_surface = module_font.render(f"{value:.1f}{unit}", True, (255, 0, 0))  # Red
-            elif value > state_of_charge_threshold[1]:                         
-                value_surface = module_font.render(f"{value:.1f}{unit}", True, (255, 165, 0))  # Orange
-            elif value < state_of_charge_threshold[2]:                         
-                value_surface = module_font.render(f"{value:.1f}{unit}", True, (255, 0, 0))  # Red
-            elif value < state_of_charge_threshold[3]:
-                value_surface = module_font.render(f"{value:.1f}{unit}", True, (255, 165, 0))  # Orange
-            else:                                                              
-                value_surface = module_font.render(f"{value:.1f}{unit}", True, (0, 255, 0))  # Green
-        else:                                                                  
-            value_surface = module_font.render(f"{value:.2f}{unit}", True, (255, 255, 255))  # White
-        value_rect = value_surface.get_rect(left=stat_rect.right + 10, top=stat_rect.top)
-        window.blit(value_surface, value_rect)
-
-def main():
+            text = f"{value:.1f}{unit}"
+            color = alarm_color(alarms.module_soc[row])
+        else:
+            text = f"{value:.2f}{unit}"
+            color = white
+        screen.draw_value(label_key, module_font, text, color, left=stat_rect.right + 10, top=stat_rect.top)
+
+telemetry_event_pending = False
+
+def notify_new_telemetry(source, version):
+    # Called from the producer's thread; post at most one wake-up until it's handled
+    global telemetry_event_pending
+    if not telemetry_event_pending:
+        telemetry_event_pending = True
+        pygame.event.post(pygame.event.Event(TELEMETRY_EVENT, source=source, version=version))
+
+def handle_replay_key(key):
+    # Playback controls: SPACE pause, UP/DOWN speed, PAGEUP/PAGEDOWN skip 10s, HOME/END jump
+    if key == pygame.K_SPACE:
+        replay_source.toggle_pause()
+    elif key == pygame.K_UP:
+        replay_source.set_speed(min(replay_source.speed * 2, 256))
+    elif key == pygame.K_DOWN:
+        replay_source.set_speed(max(replay_source.speed / 2, 1 / 16))
+    elif key == pygame.K_PAGEUP:
+        replay_source.skip(10)
+    elif key == pygame.K_PAGEDOWN:
+        replay_source.skip(-10)
+    elif key == pygame.K_HOME:
+        replay_source.seek(replay_source.recording.start_time)
+    elif key == pygame.K_END:
+        replay_source.seek(replay_source.recording.end_time)
+
+def update_replay_caption():
+    position = replay_source.position() - replay_source.recording.start_time
+    state = "paused" if replay_source.paused else f"x{replay_source.speed:g}"
+    caption = f"Batteries Dash - replay {int(position) // 60:02d}:{int(position) % 60:02d} {state}"
+    if caption != pygame.display.get_caption()[0]:
+        pygame.display.set_caption(caption)
+
+# Performance page: timing of each hot path, from the profiler, while it is shown
+PERF_STAGES = ['frame', 'data_load', 'alarms', 'text_render', 'display_update', 'producer_tick', 'ingest_decode']
+PERF_COLUMNS = [('Stage', 50), ('Calls', 260), ('p50 ms', 380), ('p99 ms', 500), ('max ms', 620)]
+
+def render_performance(pack):
+    perf_title_text = render_text(title_font, "Performance", white)
+    screen.blit_static(perf_title_text, perf_title_text.get_rect(midtop=(window.get_width()/2, 20)))
+    for title, left in PERF_COLUMNS:
+        screen.blit_static(render_text(module_font, title, grey), (left, 70))
+    for i, stage in enumerate(PERF_STAGES):
+        top = 100 + i * 32
+        screen.blit_static(render_text(module_font, stage, white), (PERF_COLUMNS[0][1], top))
+        histogram = profiler.histograms.get(stage)
+        if histogram is None or not histogram.count:
+            cells = ['-'] * 4  # Not run in this process, or not yet
+        else:
+            cells = [str(histogram.count)] + [f"{seconds * 1e3:.3f}" for seconds in (
+                histogram.percentile(50), histogram.percentile(99), histogram.max)]
+        for j, text in enumerate(cells):
+            screen.draw_value(('perf', stage, j), module_font, text, white, left=PERF_COLUMNS[j + 1][1], top=top)
+
+    top = 110 + len(PERF_STAGES) * 32
+    if replay_source is not None:
+        age_text, age_color = "replay", white
+    elif data_time:
+        age = time.time() - data_time
+        age_text = f"{age:.1f} s" if age >= 0.1 else f"{age * 1e3:.0f} ms"
+        age_color = (255, 0, 0) if age > STALE_AFTER else (0, 255, 0)
+    else:
+        age_text, age_color = "no data", (255, 0, 0)
+    rows = [
+        ("FPS", f"{clock.get_fps():.1f}", white),
+        ("Data age", age_text, age_color),
+        ("Dropped updates", str(profiler.counters.get('dropped_updates', 0)), white),
+        ("Load errors", str(profiler.counters.get('load_errors', 0)), white),
+    ]
+    for i, (label, text, color) in enumerate(rows):
+        row_top = top + i * 32
+        screen.blit_static(render_text(module_font, label, white), (PERF_COLUMNS[0][1], row_top))
+        screen.draw_value(('perf', label), module_font, text, color, left=PERF_COLUMNS[1][1], top=row_top)
+
+def draw_frame(pack, page, trend_view=False, perf_view=False):
+    # Draw one page of the pack and push the changed rects to the display
+    screen.begin((page, trend_view, perf_view, module_row_page))
+    record_trend(pack)
+    if perf_view:
+        render_performance(pack)
+    elif trend_view:
+        if page == MAIN_PAGE:
+            render_main_trends(pack)
+        else:
+            render_module_trends(pack, page)
+    elif page == MAIN_PAGE:
+        render_main_page(pack)
+    else: 
+        render_module(pack, page)
+    screen.end()
+
+def start_simulator():
+    try:
+        # Import and start battery simulator in a separate thread
+        import threading
+        from battery_data_simulator import main as run_simulator
+        simulator_thread = threading.Thread(target=run_simulator, daemon=True)
+        simulator_thread.start()
+        print("Battery simulator started...")
+    except ImportError:
+        print("Warning: Battery simulator not found. Running without simulation.")
+
+def main(max_fps=MAX_FPS, idle_fps=IDLE_FPS, replay=None, replay_speed=1.0, simulator=False, profile=False):
+    # simulator: start the in-process simulator thread once the first frame is up
+    global telemetry_event_pending, replay_source, module_row_page
+    started = time.perf_counter()
+    if profile:
+        profiler.enabled = True
+    init_display()
     running = True
+    first_frame = True
     current_page = 0
-
-    # Ask user if they want to run with simulator
-    user_input = input("Run with battery data simulator? (y/n): ").lower()
-    if user_input == 'y':
-        try:
-            # Import and start battery simulator in a separate thread
-            import threading
-            from battery_data_simulator import main as run_simulator
-            simulator_thread = threading.Thread(target=run_simulator, daemon=True)
-            simulator_thread.start()
-            print("Battery simulator started...")
-        except ImportError:
-            print("Warning: Battery simulator not found. Running without simulation.")
+    trend_view = False
+    perf_view = False
+    profile_at_start = profiler.enabled
+    pack = PackState(*pack_topology)  # Until the first frame is read
+    idle_timeout_ms = int(1000 / idle_fps)
+    store.subscribe(notify_new_telemetry)
+
+    if replay:
+        # Replay a recording through the same render path as live data
+        from replay import Recording, ReplaySource
+        replay_source = ReplaySource(Recording(replay), speed=replay_speed)
+        print(f"Replaying {replay}")
 
     while running: 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+        # Block until something happens, then drain the queue so a burst becomes one frame
+        if first_frame:
+            timeout_ms = 0  # Show whatever data there is straight away
+        elif replay_source is not None and not replay_source.paused:
+            timeout_ms = int(1000 / max_fps)  # Playback advances every frame
+        else:
+            timeout_ms = idle_timeout_ms
+        events = ([pygame.event.wait(timeout_ms)] if timeout_ms else []) + pygame.event.get()
+        for event in events:
+            # Row paging and overview clicks act on the page itself, not on the trend or performance views
+            page_view = not trend_view and not perf_view
+            if event.type == TELEMETRY_EVENT:
+                telemetry_event_pending = False
+            elif event.type == pygame.QUIT:
                 running = False
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                screen.invalidate()  # Window contents were lost, redraw everything
             elif event.type == pygame.KEYDOWN:
                 if (event.key == pygame.K_w and pygame.key.get_mods() & pygame.KMOD_CTRL) or event.key == pygame.K_ESCAPE:
                     running = False
-                elif event.key == pygame.K_RIGHT:
-                    current_page = (current_page + 1) % TOTAL_PAGES
-                elif event.key == pygame.K_LEFT:
-                    current_page = (current_page - 1) % TOTAL_PAGES
-
-        window.fill(black)
-
-        if current_page == 0:
-            render_main_page()
-        else: 
-            render_module(current_page)
-
-        pygame.display.update()
-        clock.tick(60)
-
+                elif event.key in (pygame.K_RIGHT, pygame.K_LEFT):
+                    step = MODULE_JUMP if pygame.key.get_mods() & pygame.KMOD_SHIFT else 1
+                    if event.key == pygame.K_LEFT:
+                        step = -step
+                    current_page = (current_page + step) % (pack.num_modules + 1)
+                    module_row_page = 0
+                elif event.key == pygame.K_t:
+                    trend_view = not trend_view
+                elif event.key == pygame.K_p:
+                    # Collect timings only while the page is shown, unless profiling from startup
+                    perf_view = not perf_view
+                    profiler.enabled = perf_view or profile_at_start
+                elif event.key in (pygame.K_UP, pygame.K_DOWN) and replay_source is None:
+                    if page_view:
+                        step = 1 if event.key == pygame.K_DOWN else -1
+                        module_row_page = min(max(module_row_page + step, 0), row_pages(pack) - 1)
+                elif replay_source is not None:
+                    handle_replay_key(event.key)
+            elif event.type == pygame.MOUSEWHEEL and page_view:
+                module_row_page = min(max(module_row_page - event.y, 0), row_pages(pack) - 1)
+            elif (event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and current_page == MAIN_PAGE
+                  and page_view):
+                module_key = overview_module_at(event.pos, pack.num_modules)
+                if module_key is not None:
+                    current_page = module_key
+                    module_row_page = 0
+
+        frame_start = profiler.start()
+        pack = get_pack_state()
+        # The pack may have shrunk since the last frame
+        current_page %= pack.num_modules + 1
+        module_row_page = min(module_row_page, row_pages(pack) - 1)
+        if replay_source is not None:
+            update_replay_caption()
+        draw_frame(pack, current_page, trend_view, perf_view)
+        profiler.stop('frame', frame_start)
+        if first_frame:
+            first_frame = False
+            print(f"First frame after {(time.perf_counter() - started) * 1e3:.0f} ms")
+            if simulator and replay_source is None:
+                start_simulator()
+        clock.tick(max_fps)  # Cap the frame rate; events arriving meanwhile are coalesced
+
+    store.unsubscribe(notify_new_telemetry)
     pygame.quit()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Batteries Dash")
+    parser.add_argument("--replay", metavar="DIR", help="Replay a telemetry recording instead of live data")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier (default: 1)")
+    parser.add_argument("--simulator", action=argparse.BooleanOptionalAction,
+                        default=os.environ.get("BATTERY_SIMULATOR", "0") not in ("", "0"),
+                        help="Run the battery data simulator in-process (default: $BATTERY_SIMULATOR, else off)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Collect hot-path timings from startup, not just while the performance page is shown")
+    args = parser.parse_args()
+    main(replay=args.replay, replay_speed=args.speed, simulator=args.simulator, profile=args.profile)
\ No newline at end of file
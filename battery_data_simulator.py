@@ -6,12 +6,26 @@ This script simulates battery data by updating CSV files with realistic values.
 It's a simple alternative to CAN bus simulation for initial development.
 """
 
+import argparse
 import csv
-import random
 import time
 import os
 import math
-from typing import Dict, List, Any
+import signal
+import sys
+import threading
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from aggregates import PackAggregates
+from alarms import AlarmEngine
+from instrumentation import profiler
+from pack_state import (MAIN_PAGE_CSV, PACK_CONFIG_CSV, SNAPSHOT_FILE, PackState, module_csv, pack_csv_paths,
+                        read_snapshot, write_snapshot)
+from recorder import TelemetryRecorder, new_recording_dir
+from shared_buffer import SHARED_BUFFER_PATH, SharedPackReader, SharedPackWriter
+from telemetry_store import store
 
 def read_csv(filename: str) -> Dict[str, float]:
     """Read a CSV file with Name,Data format and return as dictionary"""
@@ -38,140 +52,214 @@ def write_csv(filename: str, data: Dict[str, Any]) -> None:
         for key, value in data.items():
             writer.writerow([key, value])
 
-def update_main_page_data() -> None:
-    """Update the main page data file with realistic values"""
-    data = read_csv("./data/main_page.csv")
-    
-    # If file didn't exist, initialize with default values
-    if not data:
-        data = {
-            "current": 0.0,
-            "voltage": 0.0,
-            "max_temp": 0.0,
-            "avg_temp": 0.0,
-            "max_cell_voltage": 0.0,
-            "min_cell_voltage": 0.0,
-            "total_voltage": 0.0,
-            "soc": 0.0
-        }
-    
-    # Update values with realistic changes
-    data["current"] += random.uniform(-5, 5)
-    if abs(data["current"]) < 0.5:
-        data["current"] = random.choice([-1, 1]) * random.uniform(0.5, 5)
-    data["current"] = max(-150, min(150, data["current"]))
-    
-    # Voltage changes based on current
-    voltage_change = -0.05 * (data["current"] / 100.0)
-    data["total_voltage"] += voltage_change + random.uniform(-0.2, 0.2)
-    data["total_voltage"] = max(300, min(400, data["total_voltage"]))
-    data["voltage"] = data["total_voltage"]  # For display purposes
-    
-    # SOC changes based on current
-    soc_change = -0.01 * (data["current"] / 10.0)
-    data["soc"] += soc_change + random.uniform(-0.05, 0.05)
-    data["soc"] = max(0, min(100, data["soc"]))
-    
-    write_csv("./data/main_page.csv", data)
-    return data
+def load_pack_state(config: str = PACK_CONFIG_CSV) -> PackState:
+    """Load the last written pack state, with defaults for anything not written yet.
 
-def update_module_data(module_num: int) -> None:
-    """Update a module data file with realistic values"""
-    filename = f"./data/module_{module_num}_data.csv"
-    data = read_csv(filename)
-    
-    # If file didn't exist, initialize with default values
-    if not data:
-        data = {
-            # Cell voltages
-            "Cell_1_Voltage": 3.0,
-            "Cell_2_Voltage": 3.0,
-            "Cell_3_Voltage": 3.0,
-            "Cell_4_Voltage": 3.0,
-            "Cell_5_Voltage": 3.0,
-            "Cell_6_Voltage": 3.0,
-            "Cell_7_Voltage": 3.0,
-            "Cell_8_Voltage": 3.0,
-            "Cell_9_Voltage": 3.0,
-            "Cell_10_Voltage": 3.0,
-            "Cell_11_Voltage": 3.0,
-            # Temperatures
-            "Temp_1": 60.0,
-            "Temp_2": 60.0,
-            "Temp_3": 60.0,
-            "Temp_4": 60.0,
-            "Temp_5": 60.0,
-            "Temp_6": 60.0,
-            "Temp_7": 60.0,
-            "Temp_8": 60.0,
-            # Module stats
-            "Module_SOC": 0.0,
-            "Module_Max_Voltage": 3.0,
-            "Module_Min_Voltage": 3.0,
-            "Module_Max_Temp": 60.0,
-            "Module_Avg_Temp": 60.0,
-            "Module_Status": 13
-        }
-    
-    # Update cell voltages
-    for i in range(1, 12):
-        key = f"Cell_{i}_Voltage"
-        data[key] += random.uniform(-0.002, 0.002)
-        data[key] = max(3.0, min(4.2, data[key]))
-    
-    # Update temperatures
-    for i in range(1, 9):
-        key = f"Temp_{i}"
-        data[key] += random.uniform(-0.1, 0.1)
-        data[key] = max(20, min(60, data[key]))
-    
-    # Update summary data
-    data["Module_Max_Voltage"] = max(data[f"Cell_{i}_Voltage"] for i in range(1, 12))
-    data["Module_Min_Voltage"] = min(data[f"Cell_{i}_Voltage"] for i in range(1, 12))
-    data["Module_Max_Temp"] = max(data[f"Temp_{i}"] for i in range(1, 9))
-    data["Module_Avg_Temp"] = sum(data[f"Temp_{i}"] for i in range(1, 9)) / 8
-    
-    # Calculate SOC based on average cell voltage
-    avg_voltage = sum(data[f"Cell_{i}_Voltage"] for i in range(1, 12)) / 11
-    data["Module_SOC"] = min(100, max(0, (avg_voltage - 3.0) / 1.2 * 100))
-    
-    # Update status based on conditions
-    status = 1  # Default: OK
-    if data["Module_Max_Voltage"] > 4.15:
-        status |= 2  # High voltage warning
-    if data["Module_Min_Voltage"] < 3.2:
-        status |= 4  # Low voltage warning
-    if data["Module_Max_Temp"] > 45:
-        status |= 8  # High temperature warning
-    data["Module_Status"] = status
-    
-    write_csv(filename, data)
+    The topology comes from the pack config. The last snapshot is used if it
+    matches, otherwise the legacy CSV files that exist.
+    """
+    state = PackState.from_config(config)
+    shape = (state.num_modules, state.cells_per_module, state.temps_per_module)
+    if os.path.exists(SNAPSHOT_FILE):
+        try:
+            snapshot = read_snapshot(SNAPSHOT_FILE)
+            if (snapshot.num_modules, snapshot.cells_per_module, snapshot.temps_per_module) == shape:
+                return snapshot
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: can't read {SNAPSHOT_FILE}: {e}")
+
+    # Defaults used when a file doesn't exist yet
+    state.cell_voltages.fill(3.0)
+    state.temps.fill(60.0)
+    state.module_max_voltage.fill(3.0)
+    state.module_min_voltage.fill(3.0)
+    state.module_max_temp.fill(60.0)
+    state.module_avg_temp.fill(60.0)
+    state.module_status.fill(13)
 
-def main():
-    """Main function to run the simulator"""
+    state.load_main_page_dict(read_csv(MAIN_PAGE_CSV))
+    for module_num in range(1, state.num_modules + 1):
+        if os.path.exists(module_csv(module_num)):
+            state.load_module_dict(module_num, read_csv(module_csv(module_num)))
+    return state
+
+class PackSimulator:
+    """Advances the whole pack in one vectorized step.
+
+    Noise buffers are allocated once, so a step does no per-cell Python work
+    and no per-tick array allocation beyond NumPy's reductions.
+    """
+
+    def __init__(self, state: PackState, seed: Optional[int] = None, alarms: Optional[AlarmEngine] = None):
+        self.state = state
+        self.rng = np.random.default_rng(seed)
+        self.alarms = alarms if alarms is not None else AlarmEngine.from_csv()
+        self._cell_noise = np.empty_like(state.cell_voltages)
+        self._temp_noise = np.empty_like(state.temps)
+        self.aggregates = PackAggregates(state)
+
+    def step(self) -> PackState:
+        """Advance the pack by one tick and return the updated state"""
+        self._update_pack()
+        self._update_modules()
+        return self.state
+
+    def _update_pack(self) -> None:
+        """Random walk of the pack-level current, voltage and SOC"""
+        data = self.state.pack
+        rng = self.rng
+        
+        data["current"] += rng.uniform(-5, 5)
+        if abs(data["current"]) < 0.5:
+            data["current"] = rng.choice([-1, 1]) * rng.uniform(0.5, 5)
+        data["current"] = max(-150, min(150, data["current"]))
+        
+        # Voltage changes based on current
+        voltage_change = -0.05 * (data["current"] / 100.0)
+        data["total_voltage"] += voltage_change + rng.uniform(-0.2, 0.2)
+        data["total_voltage"] = max(300, min(400, data["total_voltage"]))
+        data["voltage"] = data["total_voltage"]  # For display purposes
+        
+        # SOC changes based on current
+        soc_change = -0.01 * (data["current"] / 10.0)
+        data["soc"] += soc_change + rng.uniform(-0.05, 0.05)
+        data["soc"] = max(0, min(100, data["soc"]))
+
+    def _update_modules(self) -> None:
+        """Random walk of every cell and temperature, then module summaries"""
+        state = self.state
+        cells = state.cell_voltages
+        temps = state.temps
+        
+        # Cell voltages: uniform(-0.002, 0.002) step, clamped to 3.0-4.2V
+        self.rng.random(out=self._cell_noise)
+        self._cell_noise *= 0.004
+        self._cell_noise -= 0.002
+        cells += self._cell_noise
+        np.clip(cells, 3.0, 4.2, out=cells)
+        
+        # Temperatures: uniform(-0.1, 0.1) step, clamped to 20-60°C
+        self.rng.random(out=self._temp_noise)
+        self._temp_noise *= 0.2
+        self._temp_noise -= 0.1
+        temps += self._temp_noise
+        np.clip(temps, 20, 60, out=temps)
+        
+        # Every reading changed, so rebuild module and pack aggregates in one pass
+        self.aggregates.rebuild()
+        self.aggregates.update_pack_fields()
+        
+        # SOC based on average cell voltage
+        np.clip((self.aggregates.module_avg_voltage() - 3.0) / 1.2 * 100, 0, 100, out=state.module_soc)
+        
+        # Status bitmask from the battery_limits.csv orange limits
+        state.module_status[...] = self.alarms.evaluate(state).module_status
+
+def write_pack_state(state: PackState, output: str = "snapshot",
+                     shared_writer: Optional[SharedPackWriter] = None) -> None:
+    """Write the pack state and publish it to the telemetry store.
+
+    output is "snapshot" (one atomic file), "csv" (legacy per-module files), "both",
+    or "shm" (the memory-mapped shared buffer, given as shared_writer).
+    """
+    path = None
+    if output == "shm":
+        shared_writer.write(state)
+    if output in ("csv", "both"):
+        write_csv(MAIN_PAGE_CSV, state.main_page_dict())
+        for module_num in range(1, state.num_modules + 1):
+            write_csv(module_csv(module_num), state.module_dict(module_num))
+        path = pack_csv_paths(state.num_modules)
+    if output in ("snapshot", "both"):
+        # Written last so readers that pick the newest source prefer it
+        write_snapshot(state)
+        path = SNAPSHOT_FILE
+    store.publish("pack", state.copy(), path=path)
+
+def resume_shared_state(state: PackState, path: str = SHARED_BUFFER_PATH) -> PackState:
+    """Continue from the last frame in the shared buffer, so a restarted producer doesn't jump back"""
+    if not os.path.exists(path):
+        return state
+    try:
+        reader = SharedPackReader(path)
+    except (OSError, ValueError):
+        return state
+    try:
+        shape = (state.num_modules, state.cells_per_module, state.temps_per_module)
+        if reader.sequence() == 0 or (reader.num_modules, reader.cells_per_module, reader.temps_per_module) != shape:
+            return state
+        return reader.read()
+    except TimeoutError:
+        return state
+    finally:
+        reader.close()
+
+def main(seed: Optional[int] = None, rate: float = 1.0, output: str = "snapshot",
+         record: Optional[str] = None):
+    """Main function to run the simulator at `rate` ticks per second.
+
+    If `record` is a directory, every tick is also appended to a telemetry recording there.
+    """
     print("Battery Data Simulator")
     print("Press Ctrl+C to exit")
     
+    state = load_pack_state()
+    if output == "shm":
+        state = resume_shared_state(state)
+    simulator = PackSimulator(state, seed=seed)
+    shared_writer = None
+    if output == "shm":
+        shared_writer = SharedPackWriter(state.num_modules, state.cells_per_module, state.temps_per_module)
+    recorder = None
+    if record:
+        state = simulator.state
+        recorder = TelemetryRecorder(record, state.num_modules, state.cells_per_module, state.temps_per_module)
+        print(f"Recording to {record}")
+    if threading.current_thread() is threading.main_thread():
+        # SIGTERM from timeout, systemd or the supervisor unwinds through finally, so the last chunk is recorded
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    interval = 1.0 / rate
+    print_every = max(1, round(rate))  # Ticks per status line, about one a second
+    ticks = 0
+    
     try:
+        next_tick = time.monotonic()
         while True:
-            # Update main page data
-            main_data = update_main_page_data()
-            
-            # Update all module data
-            for module_num in range(1, 13):
-                update_module_data(module_num)
+            with profiler.span("producer_tick"):
+                state = simulator.step()
+                write_pack_state(state, output, shared_writer)
+                if recorder is not None:
+                    recorder.record(state)
             
-            # Print status
-            print(f"Updated data: {time.strftime('%H:%M:%S')} - "
-                  f"Voltage: {main_data['total_voltage']:.1f}V, "
-                  f"Current: {main_data['current']:.1f}A, "
-                  f"SOC: {main_data['soc']:.1f}%")
+            # Print status about once a second; counted in ticks, so timing jitter can't skip lines
+            if ticks % print_every == 0:
+                main_data = state.pack
+                print(f"Updated data: {time.strftime('%H:%M:%S')} - "
+                      f"Voltage: {main_data['total_voltage']:.1f}V, "
+                      f"Current: {main_data['current']:.1f}A, "
+                      f"SOC: {main_data['soc']:.1f}%")
             
-            # Wait before next update
-            time.sleep(1)
+            # Wait before next update, without drifting at high rates
+            ticks += 1
+            next_tick += interval
+            time.sleep(max(0.0, next_tick - time.monotonic()))
             
     except KeyboardInterrupt:
         print("\nExiting...")
+    finally:
+        if shared_writer is not None:
+            shared_writer.close()
+        if recorder is not None:
+            recorder.close()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Battery Data Simulator")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+    parser.add_argument("--rate", type=float, default=1.0, help="Ticks per second (default: 1)")
+    parser.add_argument("--output", choices=("snapshot", "csv", "both", "shm"), default="snapshot",
+                        help="Write one atomic pack snapshot, the legacy CSV files, both, "
+                             "or the shared memory buffer")
+    parser.add_argument("--record", nargs="?", const=new_recording_dir(), default=None, metavar="DIR",
+                        help="Also record every tick to a telemetry recording (default: ./recordings/<time>)")
+    args = parser.parse_args()
+    main(seed=args.seed, rate=args.rate, output=args.output, record=args.record) 
\ No newline at end of file
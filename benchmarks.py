@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Benchmarks
+
+Times every hot path of the pipeline at several pack sizes, headless (SDL
+dummy video driver), and reports p50/p99 latency, throughput and memory
+allocated per call.
+
+Stages:
+    simulator_step    PackSimulator.step(), including alarm evaluation
+    alarms            AlarmEngine.evaluate()
+    aggregates        PackAggregates.rebuild() + update_pack_fields()
+    write_csv         legacy per-module CSV output, every module
+    parse_csv         dashboard parse_module_data(), every module
+    write_snapshot    atomic .npz snapshot, with fsync
+    read_snapshot     read_snapshot()
+    shm_write         SharedPackWriter.write()
+    shm_read          SharedPackReader.read()
+    record            TelemetryRecorder.record()
+    trend_append      TrendHistory.append()
+    render_main       render_main_page() of a new frame
+    render_module     render_module() of a new frame
+    values_atlas      every cell voltage of a new frame through DirtyScreen.draw_value(),
+                      in alarm colours, as a dense cell grid would draw them
+    values_font       the same with the glyph atlas off (font.render() per value)
+    frame             shared buffer read + battery_dash.draw_frame(), a dashboard frame
+    paced_tick_<R>Hz  simulator step + shm write scheduled at R ticks/s;
+                      latency is how late each tick started
+    startup           fresh interpreter: import battery_dash, open the display
+                      and draw the first frame (run once, not per size)
+
+Results are written as JSON with --json. --compare checks them against an
+earlier run and exits non-zero if any stage's p50 got slower by more than
+the threshold, so it can gate a change before it goes on the car.
+
+Timing and allocation are measured in separate passes, because tracemalloc
+slows down every allocation. Allocations are the peak bytes traced during one
+call, which counts NumPy buffers as well as Python objects.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Before battery_dash opens the display
+
+import numpy as np
+
+import battery_dash
+from aggregates import PackAggregates
+from alarms import AlarmEngine
+from battery_data_simulator import PackSimulator, write_csv
+from battery_dash import draw_frame, parse_module_data, render_main_page, render_module, screen
+from pack_state import PackState, read_snapshot, write_snapshot
+from recorder import TelemetryRecorder
+from shared_buffer import SharedPackReader, SharedPackWriter
+from trends import TrendHistory
+
+DEFAULT_SIZES = ((12, 11, 8), (100, 32, 16), (200, 24, 12))
+DEFAULT_RATES = (10, 100, 1000)
+DEFAULT_ITERATIONS = 200
+ALLOCATION_ITERATIONS = 20
+PACED_DURATION = 1.0      # Seconds per paced tick run
+STARTUP_RUNS = 5
+REGRESSION_THRESHOLD = 0.25  # --compare fails on a p50 more than 25% slower
+
+
+def parse_size(text: str) -> Tuple[int, int, int]:
+    """'100x32x16' -> (100, 32, 16)"""
+    modules, cells, temps = (int(part) for part in text.lower().split("x"))
+    return modules, cells, temps
+
+
+def size_name(size: Sequence[int]) -> str:
+    return "x".join(str(part) for part in size)
+
+
+def percentiles(samples: Sequence[float]) -> Tuple[float, float]:
+    p50, p99 = np.percentile(samples, [50, 99])
+    return float(p50), float(p99)
+
+
+def time_calls(call: Callable[[], object], iterations: int,
+               prepare: Optional[Callable[[], None]] = None) -> List[float]:
+    """Seconds taken by each call; prepare() runs untimed before every call"""
+    samples = []
+    for _ in range(iterations):
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def allocations(call: Callable[[], object], iterations: int,
+                prepare: Optional[Callable[[], None]] = None) -> int:
+    """Median peak bytes traced during one call"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            if prepare is not None:
+                prepare()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            call()
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return int(np.median(peaks))
+
+
+def benchmark(name: str, size: Sequence[int], call: Callable[[], object], iterations: int,
+              prepare: Optional[Callable[[], None]] = None, units: int = 1) -> Dict:
+    """Time one stage; `units` is how many items (e.g. cells) a call processes, for throughput"""
+    for _ in range(3):  # Warm caches and lazily built state
+        if prepare is not None:
+            prepare()
+        call()
+    samples = time_calls(call, iterations, prepare)
+    p50, p99 = percentiles(samples)
+    return {
+        "stage": name,
+        "size": size_name(size),
+        "iterations": iterations,
+        "p50_ms": p50 * 1e3,
+        "p99_ms": p99 * 1e3,
+        "calls_per_s": 1.0 / p50 if p50 else float("inf"),
+        "items_per_s": units / p50 if p50 else float("inf"),
+        "alloc_bytes": allocations(call, min(iterations, ALLOCATION_ITERATIONS), prepare),
+    }
+
+
+def paced_ticks(size: Sequence[int], rate: float, duration: float, directory: str) -> Dict:
+    """Run the producer at `rate` ticks/s the way battery_data_simulator.main() does"""
+    state = _filled_state(size)
+    simulator = PackSimulator(state, seed=0)
+    writer = SharedPackWriter(*size, path=os.path.join(directory, f"paced_{size_name(size)}_{rate:g}"))
+    interval = 1.0 / rate
+    lateness = []
+    ticks = 0
+    start = next_tick = time.monotonic()
+    try:
+        while time.monotonic() - start < duration:
+            lateness.append(max(0.0, time.monotonic() - next_tick))
+            writer.write(simulator.step())
+            ticks += 1
+            next_tick += interval
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+        elapsed = time.monotonic() - start
+    finally:
+        writer.close()
+    p50, p99 = percentiles(lateness)
+    return {
+        "stage": f"paced_tick_{rate:g}Hz",
+        "size": size_name(size),
+        "iterations": ticks,
+        "p50_ms": p50 * 1e3,
+        "p99_ms": p99 * 1e3,
+        "calls_per_s": ticks / elapsed,
+        "items_per_s": ticks * size[0] * size[1] / elapsed,
+        "alloc_bytes": None,
+    }
+
+
+# Runs in a new interpreter, so module imports count towards time to first frame
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import battery_dash
+battery_dash.init_display()
+battery_dash.draw_frame(battery_dash.get_pack_state(), battery_dash.MAIN_PAGE)
+print(time.perf_counter() - start)
+"""
+
+
+def startup(runs: int) -> Dict:
+    """Import-to-first-frame time of the dashboard in a fresh process"""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        samples.append(float(output.stdout.strip().splitlines()[-1]))
+    p50, p99 = percentiles(samples)
+    return {
+        "stage": "startup",
+        "size": "config",
+        "iterations": runs,
+        "p50_ms": p50 * 1e3,
+        "p99_ms": p99 * 1e3,
+        "calls_per_s": 1.0 / p50,
+        "items_per_s": 1.0 / p50,
+        "alloc_bytes": None,
+    }
+
+
+def _filled_state(size: Sequence[int]) -> PackState:
+    state = PackState(*size)
+    state.cell_voltages.fill(3.7)
+    state.temps.fill(35.0)
+    state.module_soc.fill(60.0)
+    state.pack.update(current=20.0, voltage=350.0, total_voltage=350.0, soc=60.0)
+    return state
+
+
+def run_size(size: Sequence[int], iterations: int, directory: str) -> List[Dict]:
+    cells = size[0] * size[1]
+    state = _filled_state(size)
+    simulator = PackSimulator(state, seed=0)
+    engine = AlarmEngine.from_csv()
+    aggregates = PackAggregates(state)
+    results = []
+
+    def bench(name, call, prepare=None, units=cells, runs=iterations):
+        results.append(benchmark(name, size, call, runs, prepare, units))
+        result = results[-1]
+        print(f"  {name:<18} p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms  "
+              f"alloc {result['alloc_bytes'] / 1024:9.1f} KiB")
+
+    bench("simulator_step", simulator.step)
+    bench("alarms", lambda: engine.evaluate(state))
+    bench("aggregates", lambda: (aggregates.rebuild(), aggregates.update_pack_fields()))
+
+    csv_paths = [os.path.join(directory, f"module_{n}.csv") for n in range(1, size[0] + 1)]
+    bench("write_csv", lambda: [write_csv(path, state.module_dict(n))
+                                for n, path in enumerate(csv_paths, start=1)], runs=max(10, iterations // 10))
+    bench("parse_csv", lambda: [parse_module_data(path) for path in csv_paths], runs=max(10, iterations // 10))
+
+    snapshot_path = os.path.join(directory, "snapshot.npz")
+    bench("write_snapshot", lambda: write_snapshot(state, snapshot_path))
+    bench("read_snapshot", lambda: read_snapshot(snapshot_path))
+
+    writer = SharedPackWriter(*size, path=os.path.join(directory, f"shm_{size_name(size)}"))
+    writer.write(state)
+    reader = SharedPackReader(writer.path)
+    bench("shm_write", lambda: writer.write(state))
+    bench("shm_read", reader.read)
+
+    recorder = TelemetryRecorder(os.path.join(directory, f"recording_{size_name(size)}"), *size)
+    bench("record", lambda: recorder.record(state))
+    recorder.close()
+    trend = TrendHistory(*size)
+    bench("trend_append", lambda: trend.append(state))
+
+    # Renders get a new pack each call, as after a telemetry update, so values and alarms change
+    frames = {"pack": state}
+    page = ("bench", size_name(size))
+
+    def next_pack():
+        frames["pack"] = simulator.step().copy()
+        screen.begin(page)  # Same page, so only clears the dirty list
+
+    screen.invalidate()
+    bench("render_main", lambda: render_main_page(frames["pack"]), next_pack)
+    bench("render_module", lambda: render_module(frames["pack"], 1), next_pack)
+
+    # Dense grid: one slot per cell, laid out in columns, values change every call
+    grid_font = battery_dash.module_font
+
+    def draw_values():
+        pack = frames["pack"]
+        colors = [battery_dash.alarm_color(level) for level in battery_dash.get_alarms(pack).cell_voltages.ravel()]
+        for index, (value, color) in enumerate(zip(pack.cell_voltages.ravel().tolist(), colors)):
+            slot = index % 400
+            screen.draw_value(("grid", slot), grid_font, f"{value:.3f}V", color,
+                              left=slot // 20 * 45, top=slot % 20 * 25)
+
+    def next_grid():
+        next_pack()
+        # Rendering the colours is not part of the text cost
+        battery_dash.get_alarms(frames["pack"])
+
+    screen.use_atlas = True
+    bench("values_atlas", draw_values, next_grid)
+    screen.use_atlas = False
+    bench("values_font", draw_values, next_grid)
+    screen.use_atlas = True
+
+    def frame():
+        draw_frame(reader.read(), 1)
+
+    battery_dash.module_row_page = 0
+    bench("frame", frame, lambda: writer.write(simulator.step()))
+
+    reader.close()
+    writer.close()
+    return results
+
+
+def compare(results: List[Dict], baseline_path: str, threshold: float) -> List[str]:
+    """Stages whose p50 regressed by more than `threshold` against a saved run"""
+    with open(baseline_path) as file:
+        baseline = {(row["stage"], row["size"]): row for row in json.load(file)["results"]}
+    regressions = []
+    for row in results:
+        old = baseline.get((row["stage"], row["size"]))
+        if old is None or row["stage"].startswith("paced_tick") or not old["p50_ms"]:
+            continue
+        change = row["p50_ms"] / old["p50_ms"] - 1.0
+        if change > threshold:
+            regressions.append(f"{row['stage']} @ {row['size']}: p50 {old['p50_ms']:.3f} -> "
+                               f"{row['p50_ms']:.3f} ms (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the telemetry pipeline and dashboard, headless")
+    parser.add_argument("--sizes", default=",".join(size_name(size) for size in DEFAULT_SIZES),
+                        help="Pack sizes as MODULESxCELLSxTEMPS, comma separated")
+    parser.add_argument("--rates", default=",".join(str(rate) for rate in DEFAULT_RATES),
+                        help="Producer tick rates for the paced runs, comma separated (empty to skip)")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="Timed calls per stage")
+    parser.add_argument("--duration", type=float, default=PACED_DURATION, help="Seconds per paced run")
+    parser.add_argument("--json", metavar="PATH", help="Write results to PATH as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="Fail if p50 regressed against an earlier --json run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Allowed p50 slowdown for --compare, as a fraction (default: 0.25)")
+    args = parser.parse_args()
+
+    sizes = [parse_size(text) for text in args.sizes.split(",") if text]
+    rates = [float(text) for text in args.rates.split(",") if text]
+    directory = tempfile.mkdtemp(prefix="battery_bench.")
+    battery_dash.init_display()
+    results = []
+    try:
+        result = startup(STARTUP_RUNS)
+        results.append(result)
+        print(f"startup              p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms")
+        for size in sizes:
+            print(f"{size_name(size)} ({size[0] * size[1]} cells)")
+            results += run_size(size, args.iterations, directory)
+            for rate in rates:
+                result = paced_ticks(size, rate, args.duration, directory)
+                results.append(result)
+                print(f"  {result['stage']:<18} {result['calls_per_s']:8.1f} ticks/s  "
+                      f"late p50 {result['p50_ms']:.3f} ms  p99 {result['p99_ms']:.3f} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "results": results,
+        }
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.json}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No stage more than {args.threshold:.0%} slower than {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+CAN Ingestion Pipeline
+
+asyncio pipeline that decodes BMS CAN frames into the pack state in batches
+and publishes it to the telemetry store (and optionally the shared memory
+buffer, for a dashboard in another process).
+
+    source --(bounded queue of batches)--> decoder --> publisher
+
+A batch is a pair of arrays: arbitration IDs and an (n, 8) payload matrix, so
+decoding is a handful of vectorized NumPy operations per batch instead of
+per-frame Python. The bounded queue gives backpressure: a source that gets
+ahead of the decoder waits instead of growing memory. Each stage keeps
+counters in PipelineStats.
+
+Sources:
+    virtual_source    in-process frame generator driven by PackSimulator
+    socketcan_source  a SocketCAN interface such as vcan0 (needs python-can)
+
+BMS frame layout (8-byte payloads, little-endian):
+    0x100 cell voltages  module u8, first cell u8, 3 x u16 mV (0xFFFF = unused)
+    0x200 temperatures   module u8, first sensor u8, 3 x i16 0.1°C (0x7FFF = unused)
+    0x300 module status  module u8, status u8, SOC u16 0.01%, 4 bytes unused
+    0x010 pack           current i16 0.1A, total voltage u16 0.1V, SOC u16 0.01%, 2 bytes unused
+
+With u8 module and first-value indices, a pack on this bus has at most
+MAX_MODULES modules and MAX_VALUES cells or sensors per module.
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from aggregates import PackAggregates
+from instrumentation import profiler
+from pack_state import PackState
+from shared_buffer import SharedPackWriter
+from telemetry_store import store
+
+CELL_VOLTAGE_ID = 0x100
+TEMPERATURE_ID = 0x200
+MODULE_STATUS_ID = 0x300
+PACK_ID = 0x010
+
+VALUES_PER_FRAME = 3
+UNUSED_VOLTAGE = 0xFFFF
+UNUSED_TEMP = 0x7FFF
+MAX_MODULES = 256
+MAX_VALUES = 255 + VALUES_PER_FRAME  # Last frame starts at index 255
+
+BATCH_FRAMES = 512
+QUEUE_BATCHES = 16
+PUBLISH_INTERVAL = 0.01  # Publish to the store at most 100 times a second
+
+Batch = Tuple[np.ndarray, np.ndarray]  # (arbitration IDs, (n, 8) uint8 payloads)
+
+
+class PipelineStats:
+    """Per-stage counters"""
+
+    def __init__(self):
+        self.source_frames = 0
+        self.source_batches = 0
+        self.queue_high_water = 0
+        self.decoded_frames = 0
+        self.unknown_frames = 0
+        self.invalid_values = 0
+        self.published = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def _value_frames(values: np.ndarray, frame_id: int, unused: int, dtype: str) -> Batch:
+    """Split a (modules, n) matrix of raw integer values into 3-value frames"""
+    num_modules, count = values.shape
+    per_module = -(-count // VALUES_PER_FRAME)
+    padded = np.full((num_modules, per_module * VALUES_PER_FRAME), unused, dtype=dtype)
+    padded[:, :count] = values
+    payloads = np.empty((num_modules * per_module, 8), dtype=np.uint8)
+    payloads[:, 0] = np.repeat(np.arange(num_modules), per_module)
+    payloads[:, 1] = np.tile(np.arange(per_module) * VALUES_PER_FRAME, num_modules)
+    payloads[:, 2:] = padded.reshape(-1, VALUES_PER_FRAME).view(np.uint8)
+    return np.full(len(payloads), frame_id, dtype=np.uint16), payloads
+
+
+def encode_pack(state: PackState) -> Batch:
+    """Every frame needed to describe a whole pack, as a BMS would send it"""
+    if (state.num_modules > MAX_MODULES
+            or max(state.cells_per_module, state.temps_per_module) > MAX_VALUES):
+        raise ValueError(f"A {state.num_modules} x {state.cells_per_module} x {state.temps_per_module} pack "
+                         f"doesn't fit the CAN frame layout")
+    millivolts = np.clip(np.rint(state.cell_voltages * 1000), 0, UNUSED_VOLTAGE - 1).astype("<u2")
+    decidegrees = np.clip(np.rint(state.temps * 10), -UNUSED_TEMP, UNUSED_TEMP - 1).astype("<i2")
+    cells = _value_frames(millivolts, CELL_VOLTAGE_ID, UNUSED_VOLTAGE, "<u2")
+    temps = _value_frames(decidegrees, TEMPERATURE_ID, UNUSED_TEMP, "<i2")
+
+    status = np.zeros((state.num_modules, 8), dtype=np.uint8)
+    status[:, 0] = np.arange(state.num_modules)
+    status[:, 1] = state.module_status
+    status[:, 2:4] = np.rint(state.module_soc * 100).astype("<u2")[:, None].view(np.uint8)
+
+    pack = np.zeros((1, 8), dtype=np.uint8)
+    pack[0, 0:2] = np.array([round(state.pack["current"] * 10)], dtype="<i2").view(np.uint8)
+    pack[0, 2:4] = np.array([round(state.pack["total_voltage"] * 10)], dtype="<u2").view(np.uint8)
+    pack[0, 4:6] = np.array([round(state.pack["soc"] * 100)], dtype="<u2").view(np.uint8)
+
+    ids = np.concatenate((cells[0], temps[0], np.full(state.num_modules, MODULE_STATUS_ID, dtype=np.uint16),
+                          np.array([PACK_ID], dtype=np.uint16)))
+    return ids, np.concatenate((cells[1], temps[1], status, pack))
+
+
+def _apply_values(target: np.ndarray, payloads: np.ndarray, dtype: str, unused: int) -> int:
+    """Write 3-value frames into a (modules, n) matrix; returns how many values were out of range"""
+    module = payloads[:, 0].astype(np.intp)
+    column = payloads[:, 1].astype(np.intp)[:, None] + np.arange(VALUES_PER_FRAME)
+    raw = np.ascontiguousarray(payloads[:, 2:]).view(dtype)
+    module = np.broadcast_to(module[:, None], column.shape)
+    present = raw != unused
+    valid = present & (module < target.shape[0]) & (column < target.shape[1])
+    target[module[valid], column[valid]] = raw[valid]
+    return int(np.count_nonzero(present & ~valid))
+
+
+def decode_batch(state: PackState, batch: Batch, stats: PipelineStats,
+                 aggregates: Optional[PackAggregates] = None) -> None:
+    """Apply a batch of frames to the pack state; later frames win over earlier ones.
+
+    With aggregates, cell and temperature readings go through its incremental
+    updates, so module and pack extremes stay current without a rescan.
+    """
+    ids, payloads = batch
+    known = 0
+
+    cells = ids == CELL_VOLTAGE_ID
+    if cells.any():
+        millivolts = np.empty_like(state.cell_voltages)
+        millivolts[...] = np.nan
+        stats.invalid_values += _apply_values(millivolts, payloads[cells], "<u2", UNUSED_VOLTAGE)
+        updated = ~np.isnan(millivolts)
+        if aggregates is None:
+            state.cell_voltages[updated] = millivolts[updated] / 1000
+        else:
+            modules, cells_updated = np.nonzero(updated)
+            aggregates.update_cell_voltages(modules, cells_updated, millivolts[updated] / 1000)
+        known += int(cells.sum())
+
+    temps = ids == TEMPERATURE_ID
+    if temps.any():
+        decidegrees = np.empty_like(state.temps)
+        decidegrees[...] = np.nan
+        stats.invalid_values += _apply_values(decidegrees, payloads[temps], "<i2", UNUSED_TEMP)
+        updated = ~np.isnan(decidegrees)
+        if aggregates is None:
+            state.temps[updated] = decidegrees[updated] / 10
+        else:
+            modules, sensors = np.nonzero(updated)
+            aggregates.update_temps(modules, sensors, decidegrees[updated] / 10)
+        known += int(temps.sum())
+
+    status = ids == MODULE_STATUS_ID
+    if status.any():
+        frames = payloads[status]
+        module = frames[:, 0].astype(np.intp)
+        valid = module < state.num_modules
+        stats.invalid_values += int(np.count_nonzero(~valid))
+        state.module_status[module[valid]] = frames[valid, 1]
+        state.module_soc[module[valid]] = np.ascontiguousarray(frames[valid, 2:4]).view("<u2")[:, 0] / 100
+        known += int(status.sum())
+
+    pack = np.flatnonzero(ids == PACK_ID)
+    if len(pack):
+        frame = payloads[pack[-1]]  # Only the latest pack frame matters
+        state.pack["current"] = float(frame[0:2].view("<i2")[0]) / 10
+        state.pack["total_voltage"] = float(frame[2:4].view("<u2")[0]) / 10
+        state.pack["voltage"] = state.pack["total_voltage"]
+        state.pack["soc"] = float(frame[4:6].view("<u2")[0]) / 100
+        known += len(pack)
+
+    stats.decoded_frames += known
+    stats.unknown_frames += len(ids) - known
+
+
+async def virtual_source(queue: asyncio.Queue, stats: PipelineStats, rate: float = 100.0,
+                         seed: Optional[int] = None, batch_frames: int = BATCH_FRAMES) -> None:
+    """Generate whole-pack frame bursts from the battery data simulator, `rate` times a second (0 = flat out)"""
+    from battery_data_simulator import PackSimulator, load_pack_state
+    simulator = PackSimulator(load_pack_state(), seed=seed)
+    next_tick = time.monotonic()
+    while True:
+        ids, payloads = encode_pack(simulator.step())
+        for start in range(0, len(ids), batch_frames):
+            batch = (ids[start:start + batch_frames], payloads[start:start + batch_frames])
+            await queue.put(batch)  # Waits while the decoder is behind
+            stats.source_frames += len(batch[0])
+            stats.source_batches += 1
+            stats.queue_high_water = max(stats.queue_high_water, queue.qsize())
+        if rate:
+            next_tick += 1.0 / rate
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+        else:
+            await asyncio.sleep(0)
+
+
+async def socketcan_source(queue: asyncio.Queue, stats: PipelineStats, channel: str = "vcan0",
+                           batch_frames: int = BATCH_FRAMES) -> None:
+    """Read frames from a SocketCAN interface, batching whatever has arrived"""
+    import can  # Optional dependency: pip install python-can
+    bus = can.Bus(channel=channel, interface="socketcan")
+    reader = can.AsyncBufferedReader()
+    notifier = can.Notifier(bus, [reader], loop=asyncio.get_running_loop())
+    ids = np.empty(batch_frames, dtype=np.uint16)
+    payloads = np.empty((batch_frames, 8), dtype=np.uint8)
+    try:
+        while True:
+            message = await reader.get_message()
+            count = 0
+            while True:
+                ids[count] = message.arbitration_id
+                payloads[count] = 0
+                payloads[count, :len(message.data)] = message.data
+                count += 1
+                if count == batch_frames or reader.buffer.empty():
+                    break
+                message = reader.buffer.get_nowait()
+            await queue.put((ids[:count].copy(), payloads[:count].copy()))
+            stats.source_frames += count
+            stats.source_batches += 1
+            stats.queue_high_water = max(stats.queue_high_water, queue.qsize())
+    finally:
+        notifier.stop()
+        bus.shutdown()
+
+
+async def decode_and_publish(queue: asyncio.Queue, stats: PipelineStats, state: PackState,
+                             shared_writer: Optional[SharedPackWriter] = None,
+                             publish_interval: float = PUBLISH_INTERVAL) -> None:
+    """Decoder and publisher stages: apply batches, publish at most every publish_interval"""
+    aggregates = PackAggregates(state)
+    last_publish = 0.0
+    while True:
+        batch = await queue.get()
+        start = profiler.start()
+        decode_batch(state, batch, stats, aggregates)
+        # Fold in everything that's already queued before publishing
+        while not queue.empty():
+            decode_batch(state, queue.get_nowait(), stats, aggregates)
+        profiler.stop("ingest_decode", start)
+
+        now = time.monotonic()
+        if now - last_publish >= publish_interval:
+            last_publish = now
+            aggregates.update_pack_fields()
+            store.publish("pack", state.copy())
+            if shared_writer is not None:
+                shared_writer.write(state)
+            stats.published += 1
+
+
+async def run_pipeline(source, state: PackState, shared_writer: Optional[SharedPackWriter] = None,
+                       stats: Optional[PipelineStats] = None, report_interval: float = 0.0) -> None:
+    """Run `source(queue, stats)` and the decoder until cancelled"""
+    stats = stats if stats is not None else PipelineStats()
+    queue = asyncio.Queue(maxsize=QUEUE_BATCHES)
+    tasks = [asyncio.create_task(source(queue, stats)),
+             asyncio.create_task(decode_and_publish(queue, stats, state, shared_writer))]
+    if report_interval:
+        tasks.append(asyncio.create_task(_report(stats, report_interval)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _report(stats: PipelineStats, interval: float) -> None:
+    previous = stats.as_dict()
+    while True:
+        await asyncio.sleep(interval)
+        current = stats.as_dict()
+        rate = (current["decoded_frames"] - previous["decoded_frames"]) / interval
+        print(f"Ingest: {rate:,.0f} frames/s, queue high water {current['queue_high_water']}, "
+              f"unknown {current['unknown_frames']}, invalid {current['invalid_values']}, "
+              f"published {current['published']}")
+        previous = current
+
+
+async def send_virtual_frames(channel: str, rate: float, seed: Optional[int] = None) -> None:
+    """Put simulated BMS frames on a SocketCAN interface, for testing against vcan"""
+    import can  # Optional dependency: pip install python-can
+    from battery_data_simulator import PackSimulator, load_pack_state
+    simulator = PackSimulator(load_pack_state(), seed=seed)
+    with can.Bus(channel=channel, interface="socketcan") as bus:
+        next_tick = time.monotonic()
+        while True:
+            ids, payloads = encode_pack(simulator.step())
+            for frame_id, payload in zip(ids.tolist(), payloads):
+                bus.send(can.Message(arbitration_id=frame_id, data=payload.tobytes(), is_extended_id=False))
+            next_tick += 1.0 / rate
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BMS CAN ingestion pipeline")
+    parser.add_argument("--channel", help="SocketCAN interface to read, e.g. vcan0 (default: in-process virtual bus)")
+    parser.add_argument("--send", metavar="CHANNEL", help="Instead of ingesting, send simulated frames to CHANNEL")
+    parser.add_argument("--rate", type=float, default=100.0, help="Virtual bus pack bursts per second (0 = flat out)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the virtual bus")
+    parser.add_argument("--shm", action="store_true", help="Also write frames to the shared memory buffer")
+    args = parser.parse_args()
+
+    if args.send:
+        coroutine = send_virtual_frames(args.send, args.rate or 100.0, args.seed)
+    else:
+        state = PackState.from_config()
+        shared_writer = None
+        if args.shm:
+            shared_writer = SharedPackWriter(state.num_modules, state.cells_per_module, state.temps_per_module)
+        if args.channel:
+            source = lambda queue, stats: socketcan_source(queue, stats, args.channel)
+        else:
+            source = lambda queue, stats: virtual_source(queue, stats, args.rate, args.seed)
+        coroutine = run_pipeline(source, state, shared_writer, report_interval=1.0)
+    try:
+        asyncio.run(coroutine)
+    except KeyboardInterrupt:
+        print("\nExiting...")
+    except ImportError:
+        print("Error: python-can is required for SocketCAN interfaces (pip install python-can)")
+
+
+if __name__ == "__main__":
+    main()
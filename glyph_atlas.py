@@ -0,0 +1,81 @@
+"""
+Glyph Atlas
+
+Numeric values drawn from pre-rendered glyphs instead of font.render().
+
+Rendering a new value with font.render() lays out the string with FreeType
+and allocates a surface for it; with telemetry changing every frame, every
+value is new. An atlas renders the digits, sign, decimal point and unit
+glyphs once per font and colour into one surface, and a value is drawn by
+blitting its glyphs from that surface straight onto the target.
+
+Atlases are built on first use of a (font, colour) pair, so startup only
+pays for the colours actually shown, typically white plus the alarm colours.
+Text with any other character is left to the caller (supports() is False).
+"""
+
+from typing import Dict, Tuple
+
+import pygame
+
+NUMERIC_GLYPHS = "0123456789-+.VA%°C"
+
+
+class GlyphAtlas:
+    """Every glyph of NUMERIC_GLYPHS in one font and colour, in a single surface"""
+
+    def __init__(self, font: pygame.font.Font, color: Tuple[int, int, int],
+                 background: Tuple[int, int, int] = (0, 0, 0), glyphs: str = NUMERIC_GLYPHS):
+        # Glyphs are antialiased onto the background colour, so drawing is a plain copy with no blending
+        rendered = [font.render(glyph, True, color, background) for glyph in glyphs]
+        self.height = font.get_height()
+        surface = pygame.Surface((sum(glyph.get_width() for glyph in rendered), self.height))
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()  # Same pixel format as the window, so blits don't convert
+        surface.fill(background)
+        self.surface = surface
+        self.areas: Dict[str, pygame.Rect] = {}  # glyph -> its rect in surface
+        self.widths: Dict[str, int] = {}
+        x = 0
+        for glyph, image in zip(glyphs, rendered):
+            surface.blit(image, (x, 0))
+            self.areas[glyph] = pygame.Rect(x, 0, image.get_width(), self.height)
+            self.widths[glyph] = image.get_width()
+            x += image.get_width()
+
+    def supports(self, text: str) -> bool:
+        areas = self.areas
+        for glyph in text:
+            if glyph not in areas:
+                return False
+        return True
+
+    def width(self, text: str) -> int:
+        widths = self.widths
+        width = 0
+        for glyph in text:
+            width += widths[glyph]
+        return width
+
+    def draw(self, target: pygame.Surface, text: str, x: int, y: int) -> None:
+        """Blit text with its top-left at (x, y); every glyph must be supported"""
+        blit = target.blit
+        surface = self.surface
+        areas = self.areas
+        widths = self.widths
+        for glyph in text:
+            blit(surface, (x, y), areas[glyph])
+            x += widths[glyph]
+
+
+atlases: Dict[tuple, GlyphAtlas] = {}
+
+
+def atlas_for(font: pygame.font.Font, color: Tuple[int, int, int],
+              background: Tuple[int, int, int] = (0, 0, 0)) -> GlyphAtlas:
+    """The atlas for a font, colour and background, built on first use"""
+    key = (font, color, background)
+    atlas = atlases.get(key)
+    if atlas is None:
+        atlas = atlases[key] = GlyphAtlas(font, color, background)
+    return atlas
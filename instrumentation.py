@@ -0,0 +1,135 @@
+"""
+Instrumentation
+
+Timing spans and counters for the hot paths, kept in fixed-size log-scale
+histograms, so a long session never grows memory and percentiles stay cheap.
+
+Spans cost one attribute check when the profiler is disabled:
+
+    start = profiler.start()
+    ...
+    profiler.stop("data_load", start)
+
+or, where a few hundred nanoseconds don't matter:
+
+    with profiler.span("producer_tick"):
+        ...
+
+The dashboard's performance page turns the profiler on while it is shown;
+set BATTERY_PROFILE=1 to collect from startup.
+"""
+
+import math
+import os
+import threading
+import time
+from typing import Dict
+
+SUBBUCKETS = 4   # Buckets per doubling, so a percentile is within ~19% of the true value
+BUCKETS = 32 * SUBBUCKETS  # 1 ns to ~4 s; longer spans go in the last bucket
+
+
+class Histogram:
+    """Counts of durations in log-spaced buckets, plus count/total/max/last"""
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds: float) -> None:
+        nanoseconds = seconds * 1e9
+        index = int(math.log2(nanoseconds) * SUBBUCKETS) if nanoseconds > 1 else 0
+        self.buckets[min(index, BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """Upper edge of the bucket holding the q-th percentile (0-100), in seconds"""
+        if not self.count:
+            return 0.0
+        target = self.count * q / 100
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count:
+                return min(2 ** ((index + 1) / SUBBUCKETS) / 1e9, self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.histogram(self.name).add(time.perf_counter() - self.start)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Profiler:
+    """Named histograms and counters, shared by every thread of a process"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def start(self) -> float:
+        """Start time for stop(), or 0.0 when disabled"""
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, name: str, start: float) -> None:
+        if start:
+            self.histogram(name).add(time.perf_counter() - start)
+
+    def span(self, name: str):
+        return _Span(self, name) if self.enabled else _NO_SPAN
+
+    def count(self, name: str, amount: int = 1) -> None:
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+
+
+profiler = Profiler(enabled=os.environ.get("BATTERY_PROFILE", "0") not in ("", "0"))
@@ -0,0 +1,245 @@
+"""
+Telemetry Recorder
+
+Appends every pack snapshot to a chunked, compressed columnar log so a run
+can be analyzed afterwards. Frames are copied into preallocated column
+buffers; when a chunk fills up it is handed to a background thread that
+writes it as one compressed .npz file and appends a line to the time index.
+
+A recording directory contains:
+    recording.csv       Name,Data topology and chunk size
+    index.csv           Chunk,Start_Time,End_Time,Frames, one row per chunk
+    chunk_000000.npz    columns: time, pack, cell_voltages, temps, summary, module_status
+    level_N_*.f32/f64   min/max/mean downsample pyramid over N-frame buckets
+
+Pyramid levels are raw appended rows, one per bucket, with one column per
+signal (see signal_names()), so they can be memory-mapped for range queries.
+
+Memory is bounded at a few chunks, and nothing already on disk is rewritten.
+"""
+
+import csv
+import os
+import queue
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from pack_state import MAIN_PAGE_FIELDS, MODULE_SUMMARY_FIELDS, PackState
+
+RECORDINGS_DIR = "./recordings"
+CHUNK_FRAMES = 1000  # 10 s at 100 Hz
+INDEX_CSV = "index.csv"
+RECORDING_CSV = "recording.csv"
+PYRAMID_FACTORS = (10, 100, 1000)
+PYRAMID_STATS = ("min", "max", "mean")
+
+
+def chunk_name(number: int) -> str:
+    return f"chunk_{number:06d}.npz"
+
+
+def new_recording_dir(base: str = RECORDINGS_DIR) -> str:
+    """Timestamped directory for a new recording"""
+    return os.path.join(base, time.strftime("%Y%m%d_%H%M%S"))
+
+
+def signal_names(num_modules: int, cells_per_module: int, temps_per_module: int) -> List[str]:
+    """Names of the columns in a pyramid level, in flatten_signals() order"""
+    names = list(MAIN_PAGE_FIELDS)
+    for module in range(1, num_modules + 1):
+        names += [f"Module_{module}_Cell_{cell}_Voltage" for cell in range(1, cells_per_module + 1)]
+    for module in range(1, num_modules + 1):
+        names += [f"Module_{module}_Temp_{sensor}" for sensor in range(1, temps_per_module + 1)]
+    for key in MODULE_SUMMARY_FIELDS:
+        names += [f"Module_{module}_{key[len('Module_'):]}" for module in range(1, num_modules + 1)]
+    return names
+
+
+def flatten_signals(columns: Dict[str, np.ndarray], frames: int) -> np.ndarray:
+    """(frames, signals) float32 matrix of every numeric signal in a chunk"""
+    return np.concatenate((
+        columns["pack"][:frames],
+        columns["cell_voltages"][:frames].reshape(frames, -1),
+        columns["temps"][:frames].reshape(frames, -1),
+        columns["summary"][:frames].reshape(frames, -1),
+    ), axis=1, dtype=np.float32)
+
+
+def level_path(directory: str, factor: int, stat: str) -> str:
+    """File holding one statistic ('time', 'min', 'max' or 'mean') of a pyramid level"""
+    extension = "f64" if stat == "time" else "f32"
+    return os.path.join(directory, f"level_{factor}_{stat}.{extension}")
+
+
+class PyramidWriter:
+    """Appends min/max/mean buckets for each pyramid level as chunks are written"""
+
+    def __init__(self, directory: str, chunk_frames: int):
+        self.directory = directory
+        # Buckets must not straddle chunks, so only levels that divide the chunk size are kept
+        self.factors = [factor for factor in PYRAMID_FACTORS if chunk_frames % factor == 0]
+
+    def append(self, columns: Dict[str, np.ndarray], frames: int) -> None:
+        signals = flatten_signals(columns, frames)
+        for factor in self.factors:
+            starts = np.arange(0, frames, factor)
+            counts = np.diff(np.append(starts, frames))  # Last bucket may be partial
+            stats = {
+                "min": np.minimum.reduceat(signals, starts, axis=0),
+                "max": np.maximum.reduceat(signals, starts, axis=0),
+                "mean": (np.add.reduceat(signals, starts, axis=0, dtype=np.float64)
+                         / counts[:, None]).astype(np.float32),
+            }
+            for stat in PYRAMID_STATS:
+                with open(level_path(self.directory, factor, stat), "ab") as file:
+                    file.write(stats[stat].tobytes())
+            # Times last, so a reader sizing a level from it only sees complete rows
+            with open(level_path(self.directory, factor, "time"), "ab") as file:
+                file.write(columns["time"][starts].tobytes())
+
+
+def build_pyramids(directory: str) -> None:
+    """Build the downsample pyramid for a recording made without one"""
+    with open(os.path.join(directory, RECORDING_CSV), newline="") as file:
+        reader = csv.reader(file)
+        next(reader)  # Skip header
+        chunk_frames = int(dict(reader)["chunk_frames"])
+    with open(os.path.join(directory, INDEX_CSV), newline="") as file:
+        reader = csv.reader(file)
+        next(reader)  # Skip header
+        chunks = [row[0] for row in reader if row]
+
+    pyramid = PyramidWriter(directory, chunk_frames)
+    for factor in pyramid.factors:
+        for stat in PYRAMID_STATS + ("time",):
+            path = level_path(directory, factor, stat)
+            if os.path.exists(path):
+                os.remove(path)
+    for name in chunks:
+        with np.load(os.path.join(directory, name)) as chunk:
+            columns = {key: chunk[key] for key in chunk.files}
+        pyramid.append(columns, len(columns["time"]))
+
+
+def _allocate_columns(frames: int, num_modules: int, cells: int, temps: int) -> Dict[str, np.ndarray]:
+    return {
+        "time": np.zeros(frames, dtype=np.float64),
+        "pack": np.zeros((frames, len(MAIN_PAGE_FIELDS)), dtype=np.float64),
+        "cell_voltages": np.zeros((frames, num_modules, cells), dtype=np.float32),
+        "temps": np.zeros((frames, num_modules, temps), dtype=np.float32),
+        "summary": np.zeros((frames, len(MODULE_SUMMARY_FIELDS), num_modules), dtype=np.float32),
+        "module_status": np.zeros((frames, num_modules), dtype=np.uint8),
+    }
+
+
+class TelemetryRecorder:
+    """Records PackState frames into a recording directory"""
+
+    def __init__(self, directory: str, num_modules: int, cells_per_module: int, temps_per_module: int,
+                 chunk_frames: int = CHUNK_FRAMES, max_pending_chunks: int = 2):
+        self.directory = directory
+        self.chunk_frames = chunk_frames
+        self._shape = (num_modules, cells_per_module, temps_per_module)
+        self._columns = _allocate_columns(chunk_frames, *self._shape)
+        self._frames = 0
+        self._chunk_number = 0
+
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, RECORDING_CSV), "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["Name", "Data"])
+            writer.writerow(["num_modules", num_modules])
+            writer.writerow(["cells_per_module", cells_per_module])
+            writer.writerow(["temps_per_module", temps_per_module])
+            writer.writerow(["chunk_frames", chunk_frames])
+        with open(os.path.join(directory, INDEX_CSV), "w", newline="") as file:
+            csv.writer(file).writerow(["Chunk", "Start_Time", "End_Time", "Frames"])
+
+        self._pyramid = PyramidWriter(directory, chunk_frames)
+
+        # Full chunks waiting to be written; a full queue blocks record() instead of growing
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending_chunks)
+        self._spare: queue.Queue = queue.Queue()
+        self._error: Optional[BaseException] = None
+        self._writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self._writer.start()
+
+    def record(self, state: PackState, timestamp: Optional[float] = None) -> None:
+        """Append one frame"""
+        if self._error is not None:
+            raise self._error
+        columns = self._columns
+        i = self._frames
+        columns["time"][i] = time.time() if timestamp is None else timestamp
+        pack = columns["pack"][i]
+        for j, field in enumerate(MAIN_PAGE_FIELDS):
+            pack[j] = state.pack[field]
+        columns["cell_voltages"][i] = state.cell_voltages
+        columns["temps"][i] = state.temps
+        summary = columns["summary"][i]
+        for j, attr in enumerate(MODULE_SUMMARY_FIELDS.values()):
+            summary[j] = getattr(state, attr)
+        columns["module_status"][i] = state.module_status
+        self._frames += 1
+        if self._frames == self.chunk_frames:
+            self.flush()
+
+    def flush(self) -> None:
+        """Hand the current partial chunk to the writer thread"""
+        if self._error is not None:
+            raise self._error
+        if not self._frames:
+            return
+        self._pending.put((self._chunk_number, self._columns, self._frames))
+        self._chunk_number += 1
+        self._frames = 0
+        try:
+            self._columns = self._spare.get_nowait()  # Reuse a buffer the writer is done with
+        except queue.Empty:
+            self._columns = _allocate_columns(self.chunk_frames, *self._shape)
+
+    def close(self) -> None:
+        """Write any buffered frames and wait for the writer thread"""
+        try:
+            self.flush()
+        finally:
+            self._pending.put(None)
+            self._writer.join()
+        if self._error is not None:
+            raise self._error
+
+    def _write_chunks(self) -> None:
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # Keep draining after a failure so record() and close() never block on a full queue
+            number, columns, frames = item
+            try:
+                self._write_chunk(number, columns, frames)
+            except BaseException as e:
+                self._error = e
+                continue
+            self._spare.put(columns)
+
+    def _write_chunk(self, number: int, columns: Dict[str, np.ndarray], frames: int) -> None:
+        name = chunk_name(number)
+        fd, tmp_path = tempfile.mkstemp(prefix=".chunk.", suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                np.savez_compressed(file, **{key: column[:frames] for key, column in columns.items()})
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._pyramid.append(columns, frames)
+
+        # Index only chunks that are fully on disk
+        times = columns["time"]
+        with open(os.path.join(self.directory, INDEX_CSV), "a", newline="") as file:
+            csv.writer(file).writerow([name, repr(float(times[0])), repr(float(times[frames - 1])), frames])
@@ -0,0 +1,196 @@
+"""
+Telemetry Replay
+
+Reads recordings made by recorder.TelemetryRecorder. Recording answers
+point-in-time lookups from the sparse chunk index and time-range queries
+from the memory-mapped min/max/mean pyramid, so plotting one signal over an
+hour touches a few hundred pyramid rows instead of every frame.
+
+ReplaySource turns a recording into a pack source for the dashboard, with a
+playback clock that can be paused, sped up and scrubbed.
+"""
+
+import csv
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import numpy as np
+
+from pack_state import MAIN_PAGE_FIELDS, MODULE_SUMMARY_FIELDS, PackState
+from recorder import (INDEX_CSV, PYRAMID_FACTORS, PYRAMID_STATS, RECORDING_CSV, flatten_signals, level_path,
+                      signal_names)
+
+CHUNK_CACHE_SIZE = 3
+
+
+class Recording:
+    """Read-only view of a recording directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, RECORDING_CSV), newline="") as file:
+            reader = csv.reader(file)
+            next(reader)  # Skip header
+            info = {name: int(value) for name, value in reader}
+        self.num_modules = info["num_modules"]
+        self.cells_per_module = info["cells_per_module"]
+        self.temps_per_module = info["temps_per_module"]
+
+        # Sparse time index: one row per chunk
+        with open(os.path.join(directory, INDEX_CSV), newline="") as file:
+            reader = csv.reader(file)
+            next(reader)  # Skip header
+            rows = [row for row in reader if row]
+        if not rows:
+            raise ValueError(f"{directory} has no recorded chunks")
+        self.chunk_names = [row[0] for row in rows]
+        self.chunk_starts = np.array([float(row[1]) for row in rows])
+        self.chunk_ends = np.array([float(row[2]) for row in rows])
+        self.chunk_frames = np.array([int(row[3]) for row in rows])
+        self.start_time = float(self.chunk_starts[0])
+        self.end_time = float(self.chunk_ends[-1])
+
+        self.signals = signal_names(self.num_modules, self.cells_per_module, self.temps_per_module)
+        self.signal_index = {name: i for i, name in enumerate(self.signals)}
+        self.levels = self._map_levels()
+
+        self._chunks: OrderedDict = OrderedDict()
+        self._frame_key = None
+        self._frame = None
+
+    def _map_levels(self) -> Dict[int, Dict[str, np.ndarray]]:
+        """Memory-map every complete pyramid level, finest first"""
+        levels = {}
+        for factor in PYRAMID_FACTORS:
+            time_path = level_path(self.directory, factor, "time")
+            if not os.path.exists(time_path) or os.path.getsize(time_path) == 0:
+                continue
+            buckets = os.path.getsize(time_path) // 8
+            level = {"time": np.memmap(time_path, dtype=np.float64, mode="r", shape=(buckets,))}
+            for stat in PYRAMID_STATS:
+                level[stat] = np.memmap(level_path(self.directory, factor, stat), dtype=np.float32, mode="r",
+                                        shape=(buckets, len(self.signals)))
+            levels[factor] = level
+        return levels
+
+    def _chunk(self, number: int) -> Dict[str, np.ndarray]:
+        columns = self._chunks.get(number)
+        if columns is None:
+            with np.load(os.path.join(self.directory, self.chunk_names[number])) as chunk:
+                columns = {key: chunk[key] for key in chunk.files}
+            self._chunks[number] = columns
+            if len(self._chunks) > CHUNK_CACHE_SIZE:
+                self._chunks.popitem(last=False)
+        else:
+            self._chunks.move_to_end(number)
+        return columns
+
+    def _locate(self, timestamp: float) -> Tuple[int, int]:
+        """(chunk, frame) of the last frame at or before timestamp, clamped to the recording"""
+        number = max(0, int(np.searchsorted(self.chunk_starts, timestamp, side="right")) - 1)
+        times = self._chunk(number)["time"]
+        return number, max(0, int(np.searchsorted(times, timestamp, side="right")) - 1)
+
+    def frame_at(self, timestamp: float) -> PackState:
+        """Pack state as recorded at a point in time; the same object while the frame doesn't change"""
+        key = self._locate(timestamp)
+        if key == self._frame_key:
+            return self._frame
+        columns = self._chunk(key[0])
+        i = key[1]
+        state = PackState(self.num_modules, self.cells_per_module, self.temps_per_module)
+        state.pack = {field: float(value) for field, value in zip(MAIN_PAGE_FIELDS, columns["pack"][i])}
+        state.cell_voltages[...] = columns["cell_voltages"][i]
+        state.temps[...] = columns["temps"][i]
+        for j, attr in enumerate(MODULE_SUMMARY_FIELDS.values()):
+            getattr(state, attr)[...] = columns["summary"][i, j]
+        state.module_status[...] = columns["module_status"][i]
+        self._frame_key, self._frame = key, state
+        return state
+
+    def series(self, name: str, start: float, end: float,
+               max_points: int = 1000) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(times, mins, maxs, means) of one signal over [start, end], at most max_points long.
+
+        Uses raw frames when the range is short enough, otherwise the finest
+        pyramid level that fits, decimating further in memory if even the
+        coarsest level has too many buckets.
+        """
+        column = self.signal_index[name]
+        first = int(np.searchsorted(self.chunk_ends, start, side="left"))
+        last = int(np.searchsorted(self.chunk_starts, end, side="right"))
+        frames = int(self.chunk_frames[first:last].sum())
+
+        if frames <= max_points or not self.levels:
+            times, values = self._raw_series(column, first, last, start, end)
+            return times, values, values, values
+
+        for factor, level in self.levels.items():
+            if frames // factor <= max_points:
+                break
+        lo = max(0, int(np.searchsorted(level["time"], start, side="right")) - 1)
+        hi = int(np.searchsorted(level["time"], end, side="right"))
+        times = np.array(level["time"][lo:hi])
+        mins, maxs, means = (np.array(level[stat][lo:hi, column]) for stat in PYRAMID_STATS)
+
+        if len(times) > max_points:
+            step = -(-len(times) // max_points)
+            starts = np.arange(0, len(times), step)
+            counts = np.diff(np.append(starts, len(times)))
+            times = times[starts]
+            mins = np.minimum.reduceat(mins, starts)
+            maxs = np.maximum.reduceat(maxs, starts)
+            means = np.add.reduceat(means, starts) / counts
+        return times, mins, maxs, means
+
+    def _raw_series(self, column: int, first: int, last: int, start: float,
+                    end: float) -> Tuple[np.ndarray, np.ndarray]:
+        times, values = [], []
+        for number in range(first, min(last, len(self.chunk_names))):
+            columns = self._chunk(number)
+            lo = int(np.searchsorted(columns["time"], start, side="left"))
+            hi = int(np.searchsorted(columns["time"], end, side="right"))
+            window = {key: column_values[lo:hi] for key, column_values in columns.items()}
+            times.append(window["time"])
+            values.append(flatten_signals(window, hi - lo)[:, column])
+        if not times:
+            return np.zeros(0), np.zeros(0, dtype=np.float32)
+        return np.concatenate(times), np.concatenate(values)
+
+
+class ReplaySource:
+    """Playback clock over a Recording, used by the dashboard in place of live telemetry"""
+
+    def __init__(self, recording: Recording, speed: float = 1.0):
+        self.recording = recording
+        self.speed = speed
+        self.paused = False
+        self._anchor_time = recording.start_time
+        self._anchor_wall = time.monotonic()
+
+    def position(self) -> float:
+        """Current playback time, in recording timestamps"""
+        if self.paused:
+            return self._anchor_time
+        position = self._anchor_time + (time.monotonic() - self._anchor_wall) * self.speed
+        return min(max(position, self.recording.start_time), self.recording.end_time)
+
+    def seek(self, timestamp: float) -> None:
+        self._anchor_time = min(max(timestamp, self.recording.start_time), self.recording.end_time)
+        self._anchor_wall = time.monotonic()
+
+    def skip(self, seconds: float) -> None:
+        self.seek(self.position() + seconds)
+
+    def set_speed(self, speed: float) -> None:
+        self.seek(self.position())
+        self.speed = speed
+
+    def toggle_pause(self) -> None:
+        self.seek(self.position())
+        self.paused = not self.paused
+
+    def pack(self) -> PackState:
+        return self.recording.frame_at(self.position())
@@ -0,0 +1,284 @@
+"""
+Shared Telemetry Buffer
+
+Memory-mapped, fixed-layout frames shared between one producer and any
+number of read-only consumers, in the same process or in separate ones.
+
+The producer writes straight into NumPy views over the mapping, so there is no
+text formatting or parsing on either side. Consistency is kept with a seqlock:
+the sequence counter is odd while a frame is being written, and a reader
+retries if the counter was odd or changed while it copied the frame out.
+
+Two kinds of buffer share this machinery:
+    pack    the PackState written by the producer (simulator or CAN ingestion)
+    alarms  alarm levels computed from a pack frame by the alarm stage
+
+Layout (little-endian, all fields 8-byte aligned):
+    header   magic, layout version, modules, cells/module, temps/module,
+             sequence, frame count, timestamp
+    fields   fixed-size arrays, see _pack_fields() / _alarm_fields()
+
+A writer reopens an existing buffer with the same layout instead of replacing
+it, so a restarted producer keeps serving consumers that already mapped it.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from alarms import PACK_SIGNALS, PackAlarms
+from pack_state import MAIN_PAGE_FIELDS, MODULE_SUMMARY_FIELDS, PackState
+
+# tmpfs on Linux, so the mapping never touches the disk
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+SHARED_BUFFER_PATH = os.path.join(SHARED_DIR, "battery_telemetry")
+ALARM_BUFFER_PATH = os.path.join(SHARED_DIR, "battery_alarms")
+
+PACK_MAGIC = b"BMS1"
+ALARM_MAGIC = b"BMA1"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<4sIIIIxxxxQQd")
+SEQUENCE_OFFSET = 24
+FRAMES_OFFSET = 32
+TIMESTAMP_OFFSET = 40
+
+_SEQUENCE = struct.Struct("<Q")
+_TIMESTAMP = struct.Struct("<d")
+
+Field = Tuple[str, type, Tuple[int, ...]]
+
+
+def _pack_fields(num_modules: int, cells_per_module: int, temps_per_module: int) -> List[Field]:
+    return [
+        ("pack", np.float64, (len(MAIN_PAGE_FIELDS),)),
+        ("cell_voltages", np.float64, (num_modules, cells_per_module)),
+        ("temps", np.float64, (num_modules, temps_per_module)),
+        ("summary", np.float64, (len(MODULE_SUMMARY_FIELDS), num_modules)),
+        ("module_status", np.uint8, (num_modules,)),
+    ]
+
+
+def _alarm_fields(num_modules: int, cells_per_module: int, temps_per_module: int) -> List[Field]:
+    return [
+        ("pack_sequence", np.uint64, (1,)),  # Sequence of the pack frame these alarms were computed from
+        ("cell_voltages", np.uint8, (num_modules, cells_per_module)),
+        ("temps", np.uint8, (num_modules, temps_per_module)),
+        ("module_soc", np.uint8, (num_modules,)),
+        ("pack", np.uint8, (len(PACK_SIGNALS),)),
+        ("module_status", np.uint8, (num_modules,)),
+    ]
+
+
+def _align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def _layout(fields: List[Field]) -> Tuple[Dict[str, tuple], int]:
+    """Offset, dtype and shape of every array in the frame, and the total size"""
+    layout = {}
+    offset = HEADER.size
+    for name, dtype, shape in fields:
+        layout[name] = (offset, dtype, shape)
+        offset += _align(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    return layout, offset
+
+
+def _views(buffer, layout: Dict[str, tuple]) -> Dict[str, np.ndarray]:
+    views = {}
+    for name, (offset, dtype, shape) in layout.items():
+        count = int(np.prod(shape))
+        views[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+    return views
+
+
+class _SeqlockWriter:
+    """Owns a buffer file and brackets each frame write with the sequence counter"""
+
+    def __init__(self, path: str, magic: bytes, fields: List[Field], topology: Tuple[int, int, int]):
+        self.path = path
+        layout, size = _layout(fields)
+        if not self._reopen(path, magic, topology, size):
+            # Build the file under a temporary name so readers never map a half-sized buffer
+            fd, tmp_path = tempfile.mkstemp(prefix=".battery_telemetry.", dir=os.path.dirname(path) or ".")
+            try:
+                os.ftruncate(fd, size)
+                self._mmap = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            HEADER.pack_into(self._mmap, 0, magic, LAYOUT_VERSION, *topology, 0, 0, 0.0)
+            os.replace(tmp_path, path)
+        self._sequence = _SEQUENCE.unpack_from(self._mmap, SEQUENCE_OFFSET)[0]
+        self._sequence += self._sequence & 1  # A previous writer may have died mid-frame
+        self._frames = _SEQUENCE.unpack_from(self._mmap, FRAMES_OFFSET)[0]
+        self._views = _views(self._mmap, layout)
+
+    def _reopen(self, path: str, magic: bytes, topology: Tuple[int, int, int], size: int) -> bool:
+        """Map an existing buffer in place if its layout matches"""
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except OSError:
+            return False
+        try:
+            if os.fstat(fd).st_size != size:
+                return False
+            buffer = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        header = HEADER.unpack_from(buffer, 0)
+        if header[0] != magic or header[1] != LAYOUT_VERSION or tuple(header[2:5]) != tuple(topology):
+            buffer.close()
+            return False
+        self._mmap = buffer
+        return True
+
+    def _begin(self) -> Dict[str, np.ndarray]:
+        self._sequence += 1  # Odd: frame in progress
+        _SEQUENCE.pack_into(self._mmap, SEQUENCE_OFFSET, self._sequence)
+        return self._views
+
+    def _end(self) -> int:
+        self._frames += 1
+        struct.pack_into("<Qd", self._mmap, FRAMES_OFFSET, self._frames, time.time())
+        self._sequence += 1  # Even: frame complete
+        _SEQUENCE.pack_into(self._mmap, SEQUENCE_OFFSET, self._sequence)
+        return self._sequence
+
+    def close(self) -> None:
+        self._views = {}
+        self._mmap.close()
+
+
+class _SeqlockReader:
+    """Maps a buffer read-only and copies out consistent frames"""
+
+    def __init__(self, path: str, magic: bytes, fields: Callable[[int, int, int], List[Field]]):
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self._mmap, 0)
+        if header[0] != magic or header[1] != LAYOUT_VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a version {LAYOUT_VERSION} {magic.decode()} buffer")
+        self.num_modules, self.cells_per_module, self.temps_per_module = header[2:5]
+        layout, _ = _layout(fields(*header[2:5]))
+        self._views = _views(self._mmap, layout)
+        self.last_sequence = 0  # Sequence of the frame returned by the last read()
+
+    def sequence(self) -> int:
+        """Sequence number of the last completed frame; changes on every write"""
+        return _SEQUENCE.unpack_from(self._mmap, SEQUENCE_OFFSET)[0] & ~1
+
+    def timestamp(self) -> float:
+        """Wall-clock time the last frame was written, 0.0 if none yet"""
+        return _TIMESTAMP.unpack_from(self._mmap, TIMESTAMP_OFFSET)[0]
+
+    def _read_consistent(self, copy: Callable[[Dict[str, np.ndarray]], None], retries: int) -> int:
+        """Run copy(views) until it saw a complete, unchanged frame; returns that frame's sequence"""
+        for _ in range(retries):
+            before = _SEQUENCE.unpack_from(self._mmap, SEQUENCE_OFFSET)[0]
+            if before & 1:
+                time.sleep(0)  # Writer mid-frame, let it finish
+                continue
+            copy(self._views)
+            if _SEQUENCE.unpack_from(self._mmap, SEQUENCE_OFFSET)[0] == before:
+                return before
+        raise TimeoutError(f"No consistent frame in {self.path} after {retries} attempts")
+
+    def close(self) -> None:
+        self._views = {}
+        self._mmap.close()
+
+
+class SharedPackWriter(_SeqlockWriter):
+    """Producer side of the pack buffer"""
+
+    def __init__(self, num_modules: int, cells_per_module: int, temps_per_module: int,
+                 path: str = SHARED_BUFFER_PATH):
+        topology = (num_modules, cells_per_module, temps_per_module)
+        super().__init__(path, PACK_MAGIC, _pack_fields(*topology), topology)
+
+    def write(self, state: PackState) -> int:
+        """Write a frame from the pack state and return its sequence number"""
+        views = self._begin()
+        pack = views["pack"]
+        for i, field in enumerate(MAIN_PAGE_FIELDS):
+            pack[i] = state.pack[field]
+        views["cell_voltages"][...] = state.cell_voltages
+        views["temps"][...] = state.temps
+        for i, attr in enumerate(MODULE_SUMMARY_FIELDS.values()):
+            views["summary"][i] = getattr(state, attr)
+        views["module_status"][...] = state.module_status
+        return self._end()
+
+
+class SharedPackReader(_SeqlockReader):
+    """Consumer side of the pack buffer"""
+
+    def __init__(self, path: str = SHARED_BUFFER_PATH):
+        super().__init__(path, PACK_MAGIC, _pack_fields)
+
+    def read(self, path: Optional[str] = None, retries: int = 100) -> PackState:
+        """Copy the latest complete frame into a new PackState.
+
+        Takes an unused `path` so it can be passed to TelemetryStore.load as a parser.
+        """
+        state = PackState(self.num_modules, self.cells_per_module, self.temps_per_module)
+        copied = {}
+
+        def copy(views):
+            copied["pack"] = views["pack"].copy()
+            state.cell_voltages[...] = views["cell_voltages"]
+            state.temps[...] = views["temps"]
+            copied["summary"] = views["summary"].copy()
+            state.module_status[...] = views["module_status"]
+
+        self.last_sequence = self._read_consistent(copy, retries)
+        state.pack = {field: float(value) for field, value in zip(MAIN_PAGE_FIELDS, copied["pack"])}
+        for i, attr in enumerate(MODULE_SUMMARY_FIELDS.values()):
+            getattr(state, attr)[...] = copied["summary"][i]
+        return state
+
+
+class SharedAlarmWriter(_SeqlockWriter):
+    """Alarm stage side of the alarm buffer"""
+
+    def __init__(self, num_modules: int, cells_per_module: int, temps_per_module: int,
+                 path: str = ALARM_BUFFER_PATH):
+        topology = (num_modules, cells_per_module, temps_per_module)
+        super().__init__(path, ALARM_MAGIC, _alarm_fields(*topology), topology)
+
+    def write(self, alarms: PackAlarms, pack_sequence: int) -> int:
+        views = self._begin()
+        views["pack_sequence"][0] = pack_sequence
+        views["cell_voltages"][...] = alarms.cell_voltages
+        views["temps"][...] = alarms.temps
+        views["module_soc"][...] = alarms.module_soc
+        views["pack"][...] = [alarms.pack[field] for field, _ in PACK_SIGNALS]
+        views["module_status"][...] = alarms.module_status
+        return self._end()
+
+
+class SharedAlarmReader(_SeqlockReader):
+    """Consumer side of the alarm buffer"""
+
+    def __init__(self, path: str = ALARM_BUFFER_PATH):
+        super().__init__(path, ALARM_MAGIC, _alarm_fields)
+
+    def read(self, retries: int = 100) -> Tuple[PackAlarms, int]:
+        """Latest alarms and the sequence of the pack frame they were computed from"""
+        copied = {}
+
+        def copy(views):
+            for name, view in views.items():
+                copied[name] = view.copy()
+
+        self.last_sequence = self._read_consistent(copy, retries)
+        pack = {field: int(level) for (field, _), level in zip(PACK_SIGNALS, copied["pack"])}
+        alarms = PackAlarms(copied["cell_voltages"], copied["temps"], copied["module_soc"], pack,
+                            copied["module_status"])
+        return alarms, int(copied["pack_sequence"][0])
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Pipeline Supervisor
+
+Runs the telemetry pipeline as separate processes connected by the shared
+memory buffers in shared_buffer.py, so none of them share a GIL:
+
+    producer    simulator or CAN ingestion, writes the pack buffer
+    alarms      evaluates battery_limits.csv against every new pack frame
+                and writes the alarm buffer
+    dashboard   renders from the pack buffer, using the alarm buffer when it
+                matches the frame on screen
+
+A stage that dies is restarted after a backoff that doubles on every crash
+in a row, up to MAX_BACKOFF. Buffers are reopened in place by a restarted
+writer, so the other stages keep running across the restart. Closing the
+dashboard shuts the whole pipeline down.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from shared_buffer import SHARED_BUFFER_PATH, SharedAlarmWriter, SharedPackReader
+
+POLL_INTERVAL = 0.002   # Alarm stage check for new pack frames, in seconds
+MONITOR_INTERVAL = 0.2  # How often the supervisor checks its stages
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 10.0
+STABLE_RUN = 30.0       # A stage up this long is healthy again, its backoff resets
+
+
+def run_simulator(rate: float, seed: Optional[int]) -> None:
+    from battery_data_simulator import main as simulate
+    simulate(seed=seed, rate=rate, output="shm")
+
+
+def run_can_ingest(channel: Optional[str], rate: float, seed: Optional[int]) -> None:
+    from can_ingest import run_pipeline, socketcan_source, virtual_source
+    from pack_state import PackState
+    from shared_buffer import SharedPackWriter
+
+    state = PackState.from_config()
+    shared_writer = SharedPackWriter(state.num_modules, state.cells_per_module, state.temps_per_module)
+    if channel:
+        source = lambda queue, stats: socketcan_source(queue, stats, channel)
+    else:
+        source = lambda queue, stats: virtual_source(queue, stats, rate, seed)
+    try:
+        asyncio.run(run_pipeline(source, state, shared_writer, report_interval=1.0))
+    finally:
+        shared_writer.close()
+
+
+def run_alarm_stage(poll_interval: float = POLL_INTERVAL) -> None:
+    """Evaluate alarms for each new pack frame until killed"""
+    from alarms import LIMITS_CSV, AlarmEngine
+
+    engine = AlarmEngine.from_csv(LIMITS_CSV)
+    while not os.path.exists(SHARED_BUFFER_PATH):
+        time.sleep(MONITOR_INTERVAL)  # Producer hasn't created the buffer yet
+    reader = SharedPackReader(SHARED_BUFFER_PATH)
+    writer = SharedAlarmWriter(reader.num_modules, reader.cells_per_module, reader.temps_per_module)
+    last_sequence = None
+    try:
+        while True:
+            sequence = reader.sequence()
+            if sequence == last_sequence or sequence == 0:
+                time.sleep(poll_interval)
+                continue
+            pack = reader.read()
+            writer.write(engine.evaluate(pack), reader.last_sequence)
+            last_sequence = reader.last_sequence
+    finally:
+        reader.close()
+        writer.close()
+
+
+def run_dashboard() -> None:
+    from battery_dash import main as dashboard
+    dashboard(simulator=False)
+
+
+class Stage:
+    """One supervised process and its restart bookkeeping"""
+
+    def __init__(self, name: str, target: Callable, args: Tuple = (), essential: bool = False):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.essential = essential  # Pipeline stops when this stage exits cleanly
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.backoff = MIN_BACKOFF
+        self.restart_at = None  # Monotonic time of a scheduled restart
+
+
+class Supervisor:
+    """Starts the pipeline stages and restarts any that crash"""
+
+    def __init__(self, stages, context=None):
+        self.stages: Dict[str, Stage] = {stage.name: stage for stage in stages}
+        # spawn gives every stage a fresh interpreter, with no SDL or thread state copied from here
+        self.context = context or multiprocessing.get_context("spawn")
+
+    def start(self) -> None:
+        for stage in self.stages.values():
+            self._start(stage)
+
+    def _start(self, stage: Stage) -> None:
+        stage.process = self.context.Process(target=stage.target, args=stage.args, name=stage.name, daemon=True)
+        stage.process.start()
+        stage.started = time.monotonic()
+        stage.restart_at = None
+        print(f"Started {stage.name} (pid {stage.process.pid})")
+
+    def poll(self) -> bool:
+        """Check every stage once; returns False when the pipeline should stop"""
+        now = time.monotonic()
+        for stage in self.stages.values():
+            if stage.restart_at is not None:
+                if now >= stage.restart_at:
+                    stage.restarts += 1
+                    self._start(stage)
+                continue
+            if stage.process.is_alive():
+                if now - stage.started >= STABLE_RUN:
+                    stage.backoff = MIN_BACKOFF
+                continue
+            exitcode = stage.process.exitcode
+            if exitcode == 0 and stage.essential:
+                print(f"{stage.name} exited, stopping")
+                return False
+            stage.restart_at = now + stage.backoff
+            print(f"{stage.name} exited with code {exitcode}, restarting in {stage.backoff:.1f}s")
+            stage.backoff = min(stage.backoff * 2, MAX_BACKOFF)
+        return True
+
+    def stop(self, timeout: float = 2.0) -> None:
+        for stage in self.stages.values():
+            if stage.process is not None and stage.process.is_alive():
+                stage.process.terminate()
+        for stage in self.stages.values():
+            if stage.process is not None:
+                stage.process.join(timeout)
+                if stage.process.is_alive():
+                    stage.process.kill()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Stop the stages on kill too
+        self.start()
+        try:
+            while self.poll():
+                time.sleep(MONITOR_INTERVAL)
+        except KeyboardInterrupt:
+            print("\nExiting...")
+        finally:
+            self.stop()
+
+
+def pipeline_stages(producer: str = "simulator", rate: float = 1.0, seed: Optional[int] = None,
+                    channel: Optional[str] = None, dashboard: bool = True):
+    if producer == "can":
+        stages = [Stage("producer", run_can_ingest, (channel, rate, seed))]
+    else:
+        stages = [Stage("producer", run_simulator, (rate, seed))]
+    stages.append(Stage("alarms", run_alarm_stage))
+    if dashboard:
+        stages.append(Stage("dashboard", run_dashboard, essential=True))
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the battery telemetry pipeline as supervised processes")
+    parser.add_argument("--producer", choices=("simulator", "can"), default="simulator",
+                        help="Where pack data comes from (default: simulator)")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="Simulator ticks or virtual CAN bursts per second (default: 1)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the producer")
+    parser.add_argument("--channel", help="SocketCAN interface for --producer can (default: in-process virtual bus)")
+    parser.add_argument("--headless", action="store_true", help="Run without the dashboard")
+    args = parser.parse_args()
+    Supervisor(pipeline_stages(args.producer, args.rate, args.seed, args.channel,
+                               dashboard=not args.headless)).run()
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Telemetry Server
+
+Headless server that streams the pack to any number of remote viewers over
+TCP. Each tick is encoded once and the same bytes are queued to every
+client, so the cost of a tick doesn't depend on the number of viewers.
+
+Every value in the pack is one slot in a flat float32 vector, in
+recorder.signal_names() order followed by each module's status. A client
+gets a keyframe with the whole vector when it connects, and deltas after
+that, which carry only the slots that moved by more than the server's
+resolution since they were last sent. Every in-sync client therefore holds
+exactly the server's vector, and every value to within that resolution.
+
+Each client has its own bounded send queue. A client that can't keep up
+doesn't block the others. When its queue fills, its backlog is dropped and
+it is sent a fresh keyframe instead.
+
+Wire format (little-endian), every message prefixed by its uint32 length:
+    header    kind u8, 3 bytes padding, frame u64, timestamp f64
+    keyframe  modules u32, cells/module u32, temps/module u32, values f32[n]
+    delta     base frame u64, count u32, slots u32[count], values f32[count]
+
+Plain TCP with length-prefixed frames keeps the server on the standard
+library. A WebSocket front end only has to forward these messages as binary
+frames.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import time
+from typing import List, Optional, Set
+
+import numpy as np
+
+from pack_state import MAIN_PAGE_FIELDS, MODULE_SUMMARY_FIELDS, PackState
+from recorder import signal_names
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+CLIENT_QUEUE = 64        # Messages buffered per client before it is resynced
+POLL_INTERVAL = 0.005    # How often the shared buffer source checks for a new frame
+RESOLUTION = 0.005       # Changes smaller than this aren't sent; half the dashboard's last digit
+LISTEN_BACKLOG = 1024    # Room for hundreds of viewers connecting at once
+SEND_BUFFER = 8 * 1024   # SO_SNDBUF per client, so a stalled client's backlog stays in its queue
+STALLED_RECEIVE_BUFFER = 2048  # Load test: SO_RCVBUF of clients that stop reading
+
+KEYFRAME = 1
+DELTA = 2
+
+LENGTH = struct.Struct("<I")
+HEADER = struct.Struct("<BxxxQd")
+TOPOLOGY = struct.Struct("<III")
+DELTA_HEADER = struct.Struct("<QI")
+
+
+class PackVector:
+    """Flat float32 view of every value in a pack, and the slices it is made of"""
+
+    def __init__(self, num_modules: int, cells_per_module: int, temps_per_module: int):
+        self.shape = (num_modules, cells_per_module, temps_per_module)
+        self.signals = signal_names(num_modules, cells_per_module, temps_per_module) + [
+            f"Module_{module}_Status" for module in range(1, num_modules + 1)]
+        self.pack = slice(0, len(MAIN_PAGE_FIELDS))
+        self.cells = slice(self.pack.stop, self.pack.stop + num_modules * cells_per_module)
+        self.temps = slice(self.cells.stop, self.cells.stop + num_modules * temps_per_module)
+        self.summary = slice(self.temps.stop, self.temps.stop + len(MODULE_SUMMARY_FIELDS) * num_modules)
+        self.status = slice(self.summary.stop, self.summary.stop + num_modules)
+
+    def fill(self, pack: PackState, out: np.ndarray) -> None:
+        out[self.pack] = [pack.pack[field] for field in MAIN_PAGE_FIELDS]
+        out[self.cells] = pack.cell_voltages.ravel()
+        out[self.temps] = pack.temps.ravel()
+        summary = out[self.summary].reshape(len(MODULE_SUMMARY_FIELDS), -1)
+        for i, attr in enumerate(MODULE_SUMMARY_FIELDS.values()):
+            summary[i] = getattr(pack, attr)
+        out[self.status] = pack.module_status
+
+    def to_pack(self, values: np.ndarray) -> PackState:
+        pack = PackState(*self.shape)
+        pack.pack = {field: float(value) for field, value in zip(MAIN_PAGE_FIELDS, values[self.pack])}
+        pack.cell_voltages[...] = values[self.cells].reshape(pack.cell_voltages.shape)
+        pack.temps[...] = values[self.temps].reshape(pack.temps.shape)
+        summary = values[self.summary].reshape(len(MODULE_SUMMARY_FIELDS), -1)
+        for i, attr in enumerate(MODULE_SUMMARY_FIELDS.values()):
+            getattr(pack, attr)[...] = summary[i]
+        pack.module_status[...] = values[self.status]
+        return pack
+
+
+def _message(kind: int, frame: int, timestamp: float, *parts: bytes) -> bytes:
+    body_length = HEADER.size + sum(len(part) for part in parts)
+    return b"".join((LENGTH.pack(body_length), HEADER.pack(kind, frame, timestamp)) + parts)
+
+
+class ServerStats:
+    """Counters for the whole server"""
+
+    def __init__(self):
+        self.frames = 0
+        self.keyframes_encoded = 0
+        self.deltas_encoded = 0
+        self.bytes_encoded = 0
+        self.clients = 0
+        self.connections = 0
+        self.resyncs = 0
+        self.dropped_messages = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class _Client:
+    def __init__(self, writer: asyncio.StreamWriter, queue_size: int):
+        self.writer = writer
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+
+class TelemetryServer:
+    """Encodes each published pack once and fans it out to every connected client"""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, queue_size: int = CLIENT_QUEUE,
+                 resolution: float = RESOLUTION):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.resolution = resolution
+        self.stats = ServerStats()
+        self._clients: Set[_Client] = set()
+        self._handlers: Set[asyncio.Task] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._layout: Optional[PackVector] = None
+        self._latest: Optional[np.ndarray] = None  # Scratch vector for the newest frame
+        self._values: Optional[np.ndarray] = None  # What every in-sync client holds
+        self._frame = 0
+        self._timestamp = 0.0
+        self._keyframe: Optional[bytes] = None  # Encoded on demand, for the current frame only
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=LISTEN_BACKLOG)
+        self.port = self._server.sockets[0].getsockname()[1]  # Resolves port 0
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        for client in list(self._clients):
+            client.writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    def publish(self, pack: PackState, timestamp: Optional[float] = None) -> None:
+        """Queue one frame to every client; must be called from the server's event loop"""
+        shape = (pack.num_modules, pack.cells_per_module, pack.temps_per_module)
+        new_topology = self._layout is None or self._layout.shape != shape
+        if new_topology:
+            self._layout = PackVector(*shape)
+            self._latest = np.zeros(len(self._layout.signals), dtype=np.float32)
+        self._layout.fill(pack, self._latest)
+        self._frame += 1
+        self._timestamp = time.time() if timestamp is None else timestamp
+        self._keyframe = None
+        self.stats.frames += 1
+
+        delta = None
+        if new_topology:
+            self._values = self._latest.copy()  # Everyone needs a keyframe
+        else:
+            # Slots that moved by more than the resolution since clients last got them
+            changed = np.flatnonzero(np.abs(self._latest - self._values) > self.resolution).astype(np.uint32)
+            self._values[changed] = self._latest[changed]
+            # A delta costs 8 bytes per changed slot, a keyframe 4 per slot
+            if self._clients and 2 * len(changed) < len(self._values):
+                delta = _message(DELTA, self._frame, self._timestamp,
+                                 DELTA_HEADER.pack(self._frame - 1, len(changed)),
+                                 changed.tobytes(), self._values[changed].tobytes())
+                self.stats.deltas_encoded += 1
+                self.stats.bytes_encoded += len(delta)
+        for client in self._clients:
+            self._send(client, delta)
+
+    def _encode_keyframe(self) -> bytes:
+        if self._keyframe is None:
+            self._keyframe = _message(KEYFRAME, self._frame, self._timestamp,
+                                      TOPOLOGY.pack(*self._layout.shape), self._values.tobytes())
+            self.stats.keyframes_encoded += 1
+            self.stats.bytes_encoded += len(self._keyframe)
+        return self._keyframe
+
+    def _send(self, client: _Client, delta: Optional[bytes]) -> None:
+        if client.queue.full():
+            # Slow client: its backlog is stale anyway, replace it with one keyframe
+            self.stats.dropped_messages += client.queue.qsize()
+            self.stats.resyncs += 1
+            while not client.queue.empty():
+                client.queue.get_nowait()
+            delta = None
+        client.queue.put_nowait(delta if delta is not None else self._encode_keyframe())
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = _Client(writer, self.queue_size)
+        # Keep the backlog in the queue, where it can be dropped, rather than in socket buffers:
+        # drain() waits until the kernel has taken everything written
+        writer.transport.set_write_buffer_limits(high=0)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        self._clients.add(client)
+        self._handlers.add(asyncio.current_task())
+        self.stats.clients += 1
+        self.stats.connections += 1
+        if self._values is not None and self._frame:
+            client.queue.put_nowait(self._encode_keyframe())
+        sender = asyncio.create_task(self._send_loop(client))
+        try:
+            # Clients don't send anything; this returns when they disconnect
+            await reader.read()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(client)
+            self._handlers.discard(asyncio.current_task())
+            self.stats.clients -= 1
+            sender.cancel()
+            writer.close()
+
+    async def _send_loop(self, client: _Client) -> None:
+        try:
+            while True:
+                messages = [await client.queue.get()]
+                while not client.queue.empty():
+                    messages.append(client.queue.get_nowait())
+                client.writer.writelines(messages)
+                await client.writer.drain()
+        except ConnectionError:
+            client.writer.close()
+
+
+class TelemetryClient:
+    """Receives the stream and keeps the latest values; use pack() for a PackState"""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        self.host = host
+        self.port = port
+        self.layout: Optional[PackVector] = None
+        self.values: Optional[np.ndarray] = None
+        self.frame = 0
+        self.timestamp = 0.0
+        self.keyframes = 0
+        self.deltas = 0
+        self.gaps = 0  # Deltas that didn't follow the frame we had, waiting for a keyframe
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self, receive_buffer: Optional[int] = None) -> None:
+        """receive_buffer limits what the kernel and the stream buffer for us while we aren't reading"""
+        if receive_buffer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        sock.setblocking(False)
+        try:
+            await asyncio.get_running_loop().sock_connect(sock, (self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        self._reader, self._writer = await asyncio.open_connection(sock=sock, limit=receive_buffer)
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def receive(self) -> int:
+        """Apply the next message and return the frame number we are now at"""
+        length = LENGTH.unpack(await self._reader.readexactly(LENGTH.size))[0]
+        body = await self._reader.readexactly(length)
+        kind, frame, timestamp = HEADER.unpack_from(body)
+        offset = HEADER.size
+        if kind == KEYFRAME:
+            shape = TOPOLOGY.unpack_from(body, offset)
+            offset += TOPOLOGY.size
+            if self.layout is None or self.layout.shape != shape:
+                self.layout = PackVector(*shape)
+            self.values = np.frombuffer(body, dtype=np.float32, offset=offset).copy()
+            self.keyframes += 1
+        elif kind == DELTA:
+            base, count = DELTA_HEADER.unpack_from(body, offset)
+            offset += DELTA_HEADER.size
+            if self.values is None or base != self.frame:
+                self.gaps += 1
+                return self.frame
+            slots = np.frombuffer(body, dtype=np.uint32, count=count, offset=offset)
+            self.values[slots] = np.frombuffer(body, dtype=np.float32, count=count, offset=offset + 4 * count)
+            self.deltas += 1
+        else:
+            raise ValueError(f"Unknown message kind {kind}")
+        self.frame, self.timestamp = frame, timestamp
+        return frame
+
+    def pack(self) -> Optional[PackState]:
+        if self.values is None:
+            return None
+        return self.layout.to_pack(self.values)
+
+
+async def serve_shared_buffer(server: TelemetryServer, poll_interval: float = POLL_INTERVAL) -> None:
+    """Publish every new frame from the shared memory buffer (battery_data_simulator.py --output shm)"""
+    from shared_buffer import SHARED_BUFFER_PATH, SharedPackReader
+
+    while not os.path.exists(SHARED_BUFFER_PATH):
+        await asyncio.sleep(0.5)  # Producer hasn't created the buffer yet
+    reader = SharedPackReader(SHARED_BUFFER_PATH)
+    last_sequence = None
+    try:
+        while True:
+            sequence = reader.sequence()
+            if sequence != last_sequence and sequence != 0:
+                server.publish(reader.read(), reader.timestamp())
+                last_sequence = reader.last_sequence
+            await asyncio.sleep(poll_interval)
+    finally:
+        reader.close()
+
+
+async def serve_simulator(server: TelemetryServer, rate: float, seed: Optional[int] = None) -> None:
+    """Publish an in-process PackSimulator at `rate` ticks per second"""
+    from battery_data_simulator import PackSimulator, load_pack_state
+
+    simulator = PackSimulator(load_pack_state(), seed=seed)
+    next_tick = time.monotonic()
+    while True:
+        server.publish(simulator.step())
+        next_tick += 1.0 / rate
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+
+
+async def _report(server: TelemetryServer, interval: float) -> None:
+    previous = server.stats.as_dict()
+    while True:
+        await asyncio.sleep(interval)
+        current = server.stats.as_dict()
+        print(f"Server: {current['clients']} clients, "
+              f"{(current['frames'] - previous['frames']) / interval:.1f} frames/s, "
+              f"{(current['bytes_encoded'] - previous['bytes_encoded']) / interval / 1024:.1f} KiB/s encoded, "
+              f"resyncs {current['resyncs']}")
+        previous = current
+
+
+async def run_server(source: str = "shm", host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                     rate: float = 10.0, seed: Optional[int] = None, report_interval: float = 0.0) -> None:
+    server = TelemetryServer(host, port)
+    await server.start()
+    print(f"Serving telemetry on {server.host}:{server.port}")
+    if source == "simulator":
+        tasks = [asyncio.create_task(serve_simulator(server, rate, seed))]
+    else:
+        tasks = [asyncio.create_task(serve_shared_buffer(server))]
+    if report_interval:
+        tasks.append(asyncio.create_task(_report(server, report_interval)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await server.close()
+
+
+async def load_test(clients: int = 300, duration: float = 10.0, rate: float = 20.0, slow_clients: int = 0,
+                    seed: Optional[int] = 0) -> dict:
+    """Serve the simulator to `clients` localhost subscribers and check they all kept up.
+
+    The last `slow_clients` of them stall: they stop reading, with a small
+    receive buffer, for most of the run and then catch up. They pass if the
+    server resynced each of them with a keyframe while the rest kept up.
+    The client queue is shortened if needed so that the stall overflows it.
+    """
+    stall = duration * 0.8
+    queue_size = max(2, min(CLIENT_QUEUE, int(rate * stall / 8)))
+    server = TelemetryServer(DEFAULT_HOST, 0, queue_size=queue_size)
+    await server.start()
+    subscribers: List[TelemetryClient] = [TelemetryClient(DEFAULT_HOST, server.port) for _ in range(clients)]
+    fast = subscribers[:clients - slow_clients]
+    slow = subscribers[len(fast):]
+    await asyncio.gather(*(client.connect() for client in fast),
+                         *(client.connect(STALLED_RECEIVE_BUFFER) for client in slow))
+
+    async def consume(client: TelemetryClient, stall: float) -> None:
+        await client.receive()  # Initial keyframe
+        await asyncio.sleep(stall)
+        while True:
+            await client.receive()
+
+    tasks = [asyncio.create_task(consume(client, 0.0)) for client in fast]
+    tasks += [asyncio.create_task(consume(client, stall)) for client in slow]
+    tasks.append(asyncio.create_task(serve_simulator(server, rate, seed)))
+    await asyncio.sleep(duration)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    fast_kept_up = (all(client.frame >= server._frame - 1 for client in fast)
+                    and sum(client.keyframes for client in fast) == len(fast)
+                    and all(np.array_equal(client.values, server._values) for client in fast
+                            if client.frame == server._frame))
+    slow_resynced = sum(client.keyframes > 1 for client in slow)
+    result = dict(server.stats.as_dict(),
+                  client_queue=queue_size,
+                  fast_clients=len(fast),
+                  fast_min_frame=min((client.frame for client in fast), default=0),
+                  fast_keyframes=sum(client.keyframes for client in fast),
+                  fast_gaps=sum(client.gaps for client in fast),
+                  fast_kept_up=fast_kept_up,
+                  slow_clients=len(slow),
+                  slow_resynced=slow_resynced,
+                  slow_keyframes=sum(client.keyframes for client in slow),
+                  slow_min_frame=min((client.frame for client in slow), default=0),
+                  passed=fast_kept_up and slow_resynced == len(slow))
+    await asyncio.gather(*(client.close() for client in subscribers))
+    await server.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless telemetry server for remote viewers")
+    parser.add_argument("--source", choices=("shm", "simulator"), default="shm",
+                        help="Serve the shared memory buffer or an in-process simulator (default: shm)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--rate", type=float, default=10.0, help="Simulator ticks per second (default: 10)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the simulator")
+    parser.add_argument("--load-test", type=int, metavar="CLIENTS",
+                        help="Instead of serving, run CLIENTS localhost subscribers against the simulator")
+    parser.add_argument("--slow-clients", type=int, default=0,
+                        help="With --load-test, how many clients stop reading for most of the run")
+    parser.add_argument("--duration", type=float, default=10.0, help="With --load-test, seconds to run")
+    args = parser.parse_args()
+
+    try:
+        if args.load_test:
+            result = asyncio.run(load_test(args.load_test, args.duration, args.rate, args.slow_clients, args.seed))
+            for name, value in result.items():
+                print(f"{name}: {value}")
+            if not result["passed"]:
+                raise SystemExit(1)
+        else:
+            asyncio.run(run_server(args.source, args.host, args.port, args.rate, args.seed, report_interval=5.0))
+    except KeyboardInterrupt:
+        print("\nExiting...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Telemetry Store
+
+Shared, thread-safe holder for the latest pack/module snapshots.
+Producers (the battery data simulator) publish into it, and the dashboard
+reads from memory, only re-parsing a CSV file when its mtime/size changed.
+"""
+
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+Paths = Union[str, Sequence[str]]
+
+
+def _file_signature(path: Paths) -> Any:
+    """Return (mtime_ns, size) for a file, or None if it doesn't exist.
+
+    For a sequence of paths, return a tuple with one signature per path.
+    """
+    if not isinstance(path, str):
+        return tuple(_file_signature(p) for p in path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class TelemetryStore:
+    """Latest snapshot per source ('pack', 'main_page', ...) with a version counter"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots: Dict[str, Any] = {}
+        self._versions: Dict[str, int] = defaultdict(int)
+        self._signatures: Dict[str, Any] = {}
+        self._subscribers: List[Callable[[str, int], None]] = []
+
+    def publish(self, source: str, data: Any, path: Optional[Paths] = None) -> int:
+        """Store a new snapshot for a source and return its version.
+
+        The snapshot is stored as-is, so producers must not mutate it afterwards.
+        If the producer also wrote the snapshot to `path`, its file signature is
+        recorded so readers don't re-parse the file they were just handed.
+        """
+        signature = _file_signature(path) if path else None
+        with self._lock:
+            self._snapshots[source] = data
+            self._versions[source] += 1
+            if path:
+                self._signatures[source] = signature
+            version = self._versions[source]
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(source, version)
+        return version
+
+    def subscribe(self, callback: Callable[[str, int], None]) -> None:
+        """Call callback(source, version) from the producer's thread after every publish.
+
+        Callbacks must be quick and thread-safe, e.g. setting an event or posting to a queue.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[str, int], None]) -> None:
+        with self._lock:
+            self._subscribers.remove(callback)
+
+    def get(self, source: str) -> Tuple[Any, int]:
+        """Return (snapshot, version) for a source; None and 0 if never published"""
+        with self._lock:
+            return self._snapshots.get(source), self._versions[source]
+
+    def version(self, source: str) -> int:
+        with self._lock:
+            return self._versions[source]
+
+    def load(self, source: str, path: Paths, parser: Callable[[Paths], Any],
+             signature: Any = None) -> Tuple[Any, int]:
+        """Return the snapshot for a source, re-parsing `path` only if it changed on disk.
+
+        Sources that aren't plain files (e.g. the shared memory buffer) pass their
+        own `signature`, such as a sequence number, instead of mtime/size.
+        """
+        if signature is None:
+            signature = _file_signature(path)
+        with self._lock:
+            if source in self._snapshots and self._signatures.get(source) == signature:
+                return self._snapshots[source], self._versions[source]
+
+        data = parser(path)
+        with self._lock:
+            self._snapshots[source] = data
+            self._versions[source] += 1
+            self._signatures[source] = signature
+            return self._snapshots[source], self._versions[source]
+
+
+# Shared store used when the simulator runs inside the dashboard process
+store = TelemetryStore()
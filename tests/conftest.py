@@ -0,0 +1,30 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pack_state import MAIN_PAGE_FIELDS, MODULE_SUMMARY_FIELDS, PackState  # noqa: E402
+
+
+def make_random_pack(num_modules=12, cells=11, temps=8, seed=0):
+    """A pack with every reading set; seed is an int or a Generator to draw from"""
+    rng = np.random.default_rng(seed)
+    state = PackState(num_modules, cells, temps)
+    state.cell_voltages[...] = rng.uniform(2.5, 4.3, state.cell_voltages.shape)
+    state.temps[...] = rng.uniform(-30.0, 80.0, state.temps.shape)  # Below freezing too
+    for attr in MODULE_SUMMARY_FIELDS.values():
+        getattr(state, attr)[...] = rng.uniform(0.0, 100.0, num_modules)
+    state.module_status[...] = rng.integers(0, 256, num_modules)
+    state.pack = {field: float(rng.uniform(0.0, 100.0)) for field in MAIN_PAGE_FIELDS}
+    state.pack["current"] = float(rng.uniform(-200.0, 200.0))  # Charging and discharging
+    return state
+
+
+@pytest.fixture
+def random_pack():
+    """make_random_pack(num_modules=12, cells=11, temps=8, seed=0)"""
+    return make_random_pack
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from aggregates import PackAggregates, SegmentTree
+from can_ingest import PipelineStats, decode_batch, encode_pack
+from pack_state import PackState
+
+
+def assert_matches_rebuild(aggregates):
+    """Incrementally maintained values equal a full rescan of the same readings"""
+    state = aggregates.state
+    expected = PackAggregates(state.copy())
+    for attr in ("module_max_voltage", "module_min_voltage", "module_max_temp", "module_avg_temp"):
+        np.testing.assert_allclose(getattr(state, attr), getattr(expected.state, attr), rtol=1e-6)
+    np.testing.assert_allclose(aggregates.module_avg_voltage(), expected.module_avg_voltage(), rtol=1e-6)
+    aggregates.update_pack_fields()
+    expected.update_pack_fields()
+    for field in ("max_temp", "avg_temp", "max_cell_voltage", "min_cell_voltage"):
+        assert state.pack[field] == pytest.approx(expected.state.pack[field], rel=1e-6)
+
+    module, cell, voltage = aggregates.highest_cell()
+    assert voltage == pytest.approx(state.cell_voltages.max()) and state.cell_voltages[module, cell] == voltage
+    module, cell, voltage = aggregates.lowest_cell()
+    assert voltage == pytest.approx(state.cell_voltages.min()) and state.cell_voltages[module, cell] == voltage
+    module, sensor, temp = aggregates.hottest_sensor()
+    assert temp == pytest.approx(state.temps.max()) and state.temps[module, sensor] == temp
+
+
+def test_single_readings_match_rebuild(random_pack):
+    rng = np.random.default_rng(0)
+    aggregates = PackAggregates(random_pack(seed=rng))
+    for _ in range(500):
+        aggregates.update_cell_voltage(int(rng.integers(12)), int(rng.integers(11)), float(rng.uniform(2.5, 4.5)))
+        aggregates.update_temp(int(rng.integers(12)), int(rng.integers(8)), float(rng.uniform(-10.0, 70.0)))
+    assert_matches_rebuild(aggregates)
+
+
+@pytest.mark.parametrize("readings", [1, 5, 40, 132])  # Sparse updates and whole-tree rebuilds
+def test_batched_readings_match_rebuild(readings, random_pack):
+    rng = np.random.default_rng(readings)
+    aggregates = PackAggregates(random_pack(seed=rng))
+    for _ in range(50):
+        flat = rng.choice(132, size=readings, replace=False)
+        aggregates.update_cell_voltages(flat // 11, flat % 11, rng.uniform(2.5, 4.5, readings))
+        flat = rng.choice(96, size=min(readings, 96), replace=False)
+        aggregates.update_temps(flat // 8, flat % 8, rng.uniform(-10.0, 70.0, len(flat)))
+    assert_matches_rebuild(aggregates)
+
+
+def test_segment_tree_update_many_odd_sizes():
+    rng = np.random.default_rng(1)
+    for n in (1, 2, 3, 7, 33):
+        values = rng.normal(size=n)
+        tree = SegmentTree(values, max)
+        index = rng.choice(n, size=max(1, n // 10), replace=False)
+        values[index] = rng.normal(size=len(index))
+        tree.update_many(index, values[index])
+        assert tree.top() == values.max()
+        assert values[tree.top_index()] == values.max()
+
+
+def test_decode_batch_keeps_aggregates_current(random_pack):
+    rng = np.random.default_rng(2)
+    source = random_pack(seed=rng)
+    state = PackState(12, 11, 8)
+    aggregates = PackAggregates(state)
+    ids, payloads = encode_pack(source)
+    for start in range(0, len(ids), 17):  # Batches that split modules
+        decode_batch(state, (ids[start:start + 17], payloads[start:start + 17]), PipelineStats(), aggregates)
+    np.testing.assert_allclose(state.cell_voltages, source.cell_voltages, atol=0.0005)
+    assert_matches_rebuild(aggregates)
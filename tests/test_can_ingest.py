@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from can_ingest import (CELL_VOLTAGE_ID, MAX_MODULES, MAX_VALUES, MODULE_STATUS_ID, PACK_ID, TEMPERATURE_ID,
+                        UNUSED_TEMP, UNUSED_VOLTAGE, PipelineStats, decode_batch, encode_pack)
+from pack_state import PackState
+
+
+def decode(batch, shape):
+    state = PackState(*shape)
+    stats = PipelineStats()
+    decode_batch(state, batch, stats)
+    return state, stats
+
+
+@pytest.mark.parametrize("shape", [(12, 11, 8), (3, 1, 2), (5, 12, 9), (2, 4, 4)])
+def test_round_trip(shape, random_pack):
+    source = random_pack(*shape)
+    source.pack.update(current=-123.4, total_voltage=402.7, voltage=402.7, soc=57.25)
+    state, stats = decode(encode_pack(source), shape)
+    np.testing.assert_allclose(state.cell_voltages, source.cell_voltages, atol=0.0005 + 1e-9)
+    np.testing.assert_allclose(state.temps, source.temps, atol=0.05 + 1e-9)
+    np.testing.assert_allclose(state.module_soc, source.module_soc, atol=0.005 + 1e-9)
+    np.testing.assert_array_equal(state.module_status, source.module_status)
+    assert state.pack["current"] == pytest.approx(-123.4)
+    assert state.pack["total_voltage"] == pytest.approx(402.7)
+    assert state.pack["soc"] == pytest.approx(57.25)
+    assert stats.invalid_values == 0 and stats.unknown_frames == 0
+
+
+def test_frame_layout_and_padding(random_pack):
+    # 11 cells: frames start at 0, 3, 6, 9 and the last one carries cells 9, 10 and an unused value
+    source = random_pack(2, 11, 8)
+    ids, payloads = encode_pack(source)
+    assert payloads.dtype == np.uint8 and payloads.shape == (len(ids), 8)
+    cells = payloads[ids == CELL_VOLTAGE_ID]
+    assert len(cells) == 2 * 4
+    np.testing.assert_array_equal(cells[:, 0], [0, 0, 0, 0, 1, 1, 1, 1])
+    np.testing.assert_array_equal(cells[:, 1], [0, 3, 6, 9] * 2)
+    last = np.ascontiguousarray(cells[3, 2:]).view("<u2")
+    assert list(last[:2]) == [round(v * 1000) for v in source.cell_voltages[0, 9:]]
+    assert last[2] == UNUSED_VOLTAGE
+
+    # 8 sensors: the frame at 6 carries sensors 6, 7 and an unused value
+    temps = payloads[ids == TEMPERATURE_ID]
+    last = np.ascontiguousarray(temps[2, 2:]).view("<i2")
+    assert last[2] == UNUSED_TEMP
+    assert len(payloads[ids == MODULE_STATUS_ID]) == 2
+    assert list(ids).count(PACK_ID) == 1
+
+
+def test_unused_values_leave_readings_alone():
+    shape = (1, 2, 1)
+    state = PackState(*shape)
+    state.cell_voltages[...] = 3.5
+    state.temps[...] = 25.0
+    frames = np.zeros((2, 8), dtype=np.uint8)
+    frames[0, 2:] = np.array([3900, UNUSED_VOLTAGE, UNUSED_VOLTAGE], dtype="<u2").view(np.uint8)
+    frames[1, 2:] = np.array([UNUSED_TEMP, UNUSED_TEMP, UNUSED_TEMP], dtype="<i2").view(np.uint8)
+    ids = np.array([CELL_VOLTAGE_ID, TEMPERATURE_ID], dtype=np.uint16)
+    stats = PipelineStats()
+    decode_batch(state, (ids, frames), stats)
+    np.testing.assert_allclose(state.cell_voltages, [[3.9, 3.5]])
+    np.testing.assert_allclose(state.temps, [[25.0]])
+    assert stats.invalid_values == 0
+
+
+def test_out_of_range_and_unknown_frames_are_counted():
+    shape = (2, 3, 3)
+    frames = np.zeros((3, 8), dtype=np.uint8)
+    frames[0, 0] = 5  # Module the pack doesn't have
+    frames[0, 2:] = np.array([3700, 3700, UNUSED_VOLTAGE], dtype="<u2").view(np.uint8)
+    frames[1, 1] = 3  # Past the last cell
+    frames[1, 2:] = np.array([3700, UNUSED_VOLTAGE, UNUSED_VOLTAGE], dtype="<u2").view(np.uint8)
+    ids = np.array([CELL_VOLTAGE_ID, CELL_VOLTAGE_ID, 0x7FF], dtype=np.uint16)
+    state, stats = decode((ids, frames), shape)
+    assert stats.invalid_values == 3
+    assert stats.unknown_frames == 1 and stats.decoded_frames == 2
+    assert not state.cell_voltages.any()
+
+
+def test_largest_pack_that_fits(random_pack):
+    source = random_pack(MAX_MODULES, MAX_VALUES, MAX_VALUES)
+    ids, payloads = encode_pack(source)
+    cells = payloads[ids == CELL_VOLTAGE_ID]
+    assert cells[:, 0].max() == MAX_MODULES - 1
+    assert cells[:, 1].max() == MAX_VALUES - 3
+    state, stats = decode((ids, payloads), source.cell_voltages.shape + (MAX_VALUES,))
+    np.testing.assert_allclose(state.cell_voltages, source.cell_voltages, atol=0.0005 + 1e-9)
+    np.testing.assert_allclose(state.temps, source.temps, atol=0.05 + 1e-9)
+    assert stats.invalid_values == 0
+
+
+@pytest.mark.parametrize("shape", [(MAX_MODULES + 1, 4, 4), (4, MAX_VALUES + 1, 4), (4, 4, MAX_VALUES + 1)])
+def test_packs_that_do_not_fit_are_rejected(shape):
+    with pytest.raises(ValueError):
+        encode_pack(PackState(*shape))
@@ -0,0 +1,55 @@
+import csv
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from recorder import INDEX_CSV, TelemetryRecorder
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_writer_failure_does_not_block_the_producer(tmp_path, random_pack, monkeypatch):
+    recorder = TelemetryRecorder(str(tmp_path), 2, 3, 2, chunk_frames=10, max_pending_chunks=1)
+
+    def disk_full(*args):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(recorder, "_write_chunk", disk_full)
+    pack = random_pack(2, 3, 2)
+    errors = []
+
+    def produce():
+        try:
+            for _ in range(1000):
+                recorder.record(pack)
+        except OSError as e:
+            errors.append(e)
+        try:
+            recorder.close()
+        except OSError as e:
+            errors.append(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    producer.join(5.0)
+    assert not producer.is_alive()
+    assert len(errors) == 2 and all(e.errno == 28 for e in errors)
+
+
+def test_sigterm_records_the_last_chunk(tmp_path):
+    shutil.copytree(os.path.join(REPO, "data"), tmp_path / "data")
+    simulator = subprocess.Popen([sys.executable, os.path.join(REPO, "battery_data_simulator.py"),
+                                  "--rate", "50", "--record", "recording"],
+                                 cwd=tmp_path, stdout=subprocess.PIPE, text=True)
+    assert simulator.stdout.readline().startswith("Battery Data Simulator")
+    time.sleep(1.0)
+    simulator.send_signal(signal.SIGTERM)
+    assert simulator.wait(10.0) == 0
+    with open(tmp_path / "recording" / INDEX_CSV, newline="") as file:
+        rows = list(csv.DictReader(file))
+    # Far less than a full chunk, so it is only on disk if close() ran
+    assert len(rows) == 1 and 0 < int(rows[0]["Frames"]) < 1000
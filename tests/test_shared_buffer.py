@@ -0,0 +1,121 @@
+import struct
+
+import numpy as np
+import pytest
+
+from alarms import PACK_SIGNALS, PackAlarms
+from pack_state import MODULE_SUMMARY_FIELDS, PackState
+from shared_buffer import (ALARM_MAGIC, FRAMES_OFFSET, HEADER, LAYOUT_VERSION, PACK_MAGIC, SEQUENCE_OFFSET,
+                           TIMESTAMP_OFFSET, SharedAlarmReader, SharedAlarmWriter, SharedPackReader, SharedPackWriter,
+                           _SEQUENCE, _alarm_fields, _layout, _pack_fields)
+
+TOPOLOGY = (5, 11, 7)  # Odd sizes so the uint8 arrays need padding
+
+
+def test_header_layout():
+    assert HEADER.size == 48
+    header = HEADER.pack(PACK_MAGIC, LAYOUT_VERSION, *TOPOLOGY, 11, 22, 33.5)
+    assert header[:4] == PACK_MAGIC
+    assert struct.unpack_from("<IIII", header, 4) == (LAYOUT_VERSION,) + TOPOLOGY
+    assert header[20:24] == b"\0\0\0\0"
+    assert struct.unpack_from("<Q", header, SEQUENCE_OFFSET)[0] == 11
+    assert struct.unpack_from("<Q", header, FRAMES_OFFSET)[0] == 22
+    assert struct.unpack_from("<d", header, TIMESTAMP_OFFSET)[0] == 33.5
+
+
+@pytest.mark.parametrize("fields", [_pack_fields, _alarm_fields])
+def test_arrays_are_aligned(fields):
+    layout, size = _layout(fields(*TOPOLOGY))
+    end = HEADER.size
+    for offset, dtype, shape in layout.values():
+        assert offset % 8 == 0 and end <= offset < end + 8  # Padded up to the next field, never overlapping
+        end = offset + int(np.prod(shape)) * np.dtype(dtype).itemsize
+    assert size % 8 == 0 and end <= size < end + 8
+
+
+def test_pack_round_trip(tmp_path, random_pack):
+    path = str(tmp_path / "pack")
+    writer = SharedPackWriter(*TOPOLOGY, path=path)
+    reader = SharedPackReader(path)
+    assert (reader.num_modules, reader.cells_per_module, reader.temps_per_module) == TOPOLOGY
+    assert reader.timestamp() == 0.0
+    source = random_pack(*TOPOLOGY)
+    first = writer.write(source)
+    second = writer.write(source)
+    assert first % 2 == 0 and second == first + 2
+    state = reader.read()
+    assert reader.last_sequence == reader.sequence() == second
+    assert reader.timestamp() > 0.0
+    np.testing.assert_array_equal(state.cell_voltages, source.cell_voltages)
+    np.testing.assert_array_equal(state.temps, source.temps)
+    np.testing.assert_array_equal(state.module_status, source.module_status)
+    for attr in MODULE_SUMMARY_FIELDS.values():
+        np.testing.assert_array_equal(getattr(state, attr), getattr(source, attr))
+    assert state.pack == source.pack
+    with open(path, "rb") as file:
+        assert len(file.read()) == _layout(_pack_fields(*TOPOLOGY))[1]
+    reader.close()
+    writer.close()
+
+
+def test_alarm_round_trip(tmp_path):
+    path = str(tmp_path / "alarms")
+    writer = SharedAlarmWriter(*TOPOLOGY, path=path)
+    reader = SharedAlarmReader(path)
+    rng = np.random.default_rng(1)
+    num_modules, cells, temps = TOPOLOGY
+    source = PackAlarms(rng.integers(0, 3, (num_modules, cells), dtype=np.uint8),
+                        rng.integers(0, 3, (num_modules, temps), dtype=np.uint8),
+                        rng.integers(0, 3, num_modules, dtype=np.uint8),
+                        {field: i % 3 for i, (field, _) in enumerate(PACK_SIGNALS)},
+                        rng.integers(0, 3, num_modules, dtype=np.uint8))
+    writer.write(source, pack_sequence=2 ** 40 + 6)
+    alarms, pack_sequence = reader.read()
+    assert pack_sequence == 2 ** 40 + 6
+    for attr in ("cell_voltages", "temps", "module_soc", "module_status"):
+        np.testing.assert_array_equal(getattr(alarms, attr), getattr(source, attr))
+    assert alarms.pack == source.pack
+    reader.close()
+    writer.close()
+
+
+def test_wrong_magic_is_rejected(tmp_path):
+    path = str(tmp_path / "alarms")
+    writer = SharedAlarmWriter(*TOPOLOGY, path=path)
+    with pytest.raises(ValueError):
+        SharedPackReader(path)
+    writer.close()
+    with open(path, "rb") as file:
+        assert file.read(4) == ALARM_MAGIC
+
+
+def test_reopened_writer_continues_the_sequence(tmp_path, random_pack):
+    path = str(tmp_path / "pack")
+    writer = SharedPackWriter(*TOPOLOGY, path=path)
+    last = writer.write(random_pack(*TOPOLOGY))
+    writer._begin()  # Dies mid-frame and leaves the sequence odd
+    writer.close()
+
+    writer = SharedPackWriter(*TOPOLOGY, path=path)
+    assert writer.write(random_pack(*TOPOLOGY)) == last + 4
+    writer.close()
+
+    # A different topology replaces the file instead of reusing it
+    writer = SharedPackWriter(4, 11, 7, path=path)
+    assert writer.write(PackState(4, 11, 7)) == 2
+    writer.close()
+
+
+def test_reader_gives_up_on_a_stuck_frame(tmp_path, random_pack):
+    path = str(tmp_path / "pack")
+    writer = SharedPackWriter(*TOPOLOGY, path=path)
+    writer.write(random_pack(*TOPOLOGY))
+    reader = SharedPackReader(path)
+    writer._begin()
+    assert _SEQUENCE.unpack_from(writer._mmap, SEQUENCE_OFFSET)[0] & 1
+    with pytest.raises(TimeoutError):
+        reader.read(retries=5)
+    writer._end()
+    reader.read()
+    reader.close()
+    writer.close()
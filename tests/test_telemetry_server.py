@@ -0,0 +1,119 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from pack_state import MAIN_PAGE_FIELDS, MODULE_SUMMARY_FIELDS
+from telemetry_server import (DELTA, DELTA_HEADER, HEADER, KEYFRAME, LENGTH, RESOLUTION, TOPOLOGY, PackVector,
+                              TelemetryClient, TelemetryServer, _message)
+
+SHAPE = (3, 5, 4)
+
+
+def assert_packs_close(pack, source, tolerance):
+    np.testing.assert_allclose(pack.cell_voltages, source.cell_voltages, atol=tolerance)
+    np.testing.assert_allclose(pack.temps, source.temps, atol=tolerance)
+    for attr in MODULE_SUMMARY_FIELDS.values():
+        np.testing.assert_allclose(getattr(pack, attr), getattr(source, attr), atol=tolerance)
+    np.testing.assert_array_equal(pack.module_status, source.module_status)
+    for field in MAIN_PAGE_FIELDS:
+        assert pack.pack[field] == pytest.approx(source.pack[field], abs=tolerance)
+
+
+def test_pack_vector_round_trip(random_pack):
+    layout = PackVector(*SHAPE)
+    values = np.zeros(len(layout.signals), dtype=np.float32)
+    assert layout.status.stop == len(values)
+    source = random_pack(*SHAPE)
+    layout.fill(source, values)
+    assert_packs_close(layout.to_pack(values), source, 1e-4)  # float32 on the wire
+
+
+def test_message_layout():
+    assert HEADER.size == 20
+    message = _message(DELTA, 9, 1.5, DELTA_HEADER.pack(8, 0))
+    assert LENGTH.unpack_from(message)[0] == len(message) - LENGTH.size
+    assert message[5:8] == b"\0\0\0"  # Padding after the kind
+    assert HEADER.unpack_from(message, LENGTH.size) == (DELTA, 9, 1.5)
+
+
+def feed(*messages):
+    """A client whose stream already holds the given messages"""
+    client = TelemetryClient()
+    client._reader = asyncio.StreamReader()
+    client._reader.feed_data(b"".join(messages))
+    client._reader.feed_eof()
+    return client
+
+
+def test_delta_on_the_wrong_base_is_ignored():
+    async def run():
+        values = np.arange(len(PackVector(*SHAPE).signals), dtype=np.float32)
+        keyframe = _message(KEYFRAME, 5, 1.0, TOPOLOGY.pack(*SHAPE), values.tobytes())
+        slots = np.array([0, 7], dtype=np.uint32)
+        update = np.array([-1.0, -2.0], dtype=np.float32)
+        stale = _message(DELTA, 8, 2.0, DELTA_HEADER.pack(7, 2), slots.tobytes(), update.tobytes())
+        current = _message(DELTA, 6, 3.0, DELTA_HEADER.pack(5, 2), slots.tobytes(), update.tobytes())
+        client = feed(keyframe, stale, current)
+
+        assert await client.receive() == 5
+        assert client.layout.shape == SHAPE
+        np.testing.assert_array_equal(client.values, values)
+
+        assert await client.receive() == 5  # Frame 7 never arrived, so this delta doesn't apply
+        assert client.gaps == 1 and client.deltas == 0
+        np.testing.assert_array_equal(client.values, values)
+
+        assert await client.receive() == 6
+        assert client.deltas == 1 and client.timestamp == 3.0
+        expected = values.copy()
+        expected[slots] = update
+        np.testing.assert_array_equal(client.values, expected)
+
+    asyncio.run(run())
+
+
+def test_delta_before_any_keyframe_is_ignored():
+    async def run():
+        client = feed(_message(DELTA, 2, 0.0, DELTA_HEADER.pack(1, 0)))
+        assert await client.receive() == 0
+        assert client.gaps == 1 and client.pack() is None
+
+    asyncio.run(run())
+
+
+def test_unknown_message_kind_is_rejected():
+    async def run():
+        client = feed(_message(9, 1, 0.0))
+        with pytest.raises(ValueError):
+            await client.receive()
+
+    asyncio.run(run())
+
+
+def test_loopback_stream(random_pack):
+    async def run():
+        server = TelemetryServer(port=0)
+        await server.start()
+        client = TelemetryClient(port=server.port)
+        try:
+            server.publish(random_pack(*SHAPE))
+            await client.connect()
+            assert await client.receive() == 1
+            assert client.keyframes == 1
+
+            # A few slots move, so the next frames go out as deltas
+            source = random_pack(*SHAPE)
+            for frame in range(2, 6):
+                source.cell_voltages[frame % SHAPE[0], frame - 1] += 0.25
+                source.temps[0, 0] += RESOLUTION / 2  # Sent only once the drift exceeds RESOLUTION
+                server.publish(source)
+                assert await client.receive() == frame
+            assert client.deltas == 4 and client.gaps == 0
+            np.testing.assert_array_equal(client.values, server._values)
+            assert_packs_close(client.pack(), source, RESOLUTION)
+        finally:
+            await client.close()
+            await server.close()
+
+    asyncio.run(run())
@@ -0,0 +1,31 @@
+import numpy as np
+import pygame
+
+from trends import TrendHistory
+
+
+def test_decimate_with_no_columns(random_pack):
+    history = TrendHistory(2, 32, 16, capacity=8)
+    for seed in range(3):
+        history.append(random_pack(2, 32, 16, seed=seed))
+    positions, mins, maxs = history.decimate(history.columns([]), 100)
+    assert len(positions) == 3
+    assert mins.shape == maxs.shape == (3, 0)
+
+
+def test_module_trend_on_the_last_row_page(random_pack, monkeypatch):
+    # 32 cells but 16 sensors: the third page of rows has cells and no sensors
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    import battery_dash
+    battery_dash.init_display()
+    monkeypatch.setattr(battery_dash, "trend_history", None)
+    monkeypatch.setattr(battery_dash, "module_row_page", 2)
+    assert not battery_dash.visible_rows(16) and battery_dash.visible_rows(32)
+    for seed in range(3):
+        battery_dash.draw_frame(random_pack(2, 32, 16, seed=seed), 2, trend_view=True)
+    assert battery_dash.trend_history.appends == 3
+    # The voltage graph has lines, the temperature graph only its hint
+    window = battery_dash.window
+    width = window.get_width() - 150
+    assert np.any(pygame.surfarray.array3d(window.subsurface((100, 85, width, 180))))
+    assert np.any(pygame.surfarray.array3d(window.subsurface((100, 300, width, 180))))
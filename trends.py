@@ -0,0 +1,90 @@
+"""
+Trend History
+
+Fixed-size NumPy ring buffer holding the recent history of every pack signal,
+one row per received frame, in the same signal order as recordings (see
+recorder.signal_names()). Trends are drawn from min/max decimation to the
+pixel width, so drawing cost depends on the graph width, not on how much
+history is kept.
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from pack_state import MAIN_PAGE_FIELDS, MODULE_SUMMARY_FIELDS, PackState
+from recorder import signal_names
+
+TREND_SAMPLES = 3600  # One hour at the simulator's default 1 Hz
+TREND_MEMORY = 64 * 1024 * 1024  # Large packs keep fewer samples rather than more memory
+
+
+class TrendHistory:
+    """Ring buffer of the last `capacity` frames of every signal, within TREND_MEMORY"""
+
+    def __init__(self, num_modules: int, cells_per_module: int, temps_per_module: int,
+                 capacity: int = TREND_SAMPLES):
+        self.shape = (num_modules, cells_per_module, temps_per_module)
+        self.signals = signal_names(num_modules, cells_per_module, temps_per_module)
+        self.capacity = max(2, min(capacity, TREND_MEMORY // (4 * len(self.signals))))
+        self.signal_index = {name: i for i, name in enumerate(self.signals)}
+        self.values = np.zeros((self.capacity, len(self.signals)), dtype=np.float32)
+        self.head = 0    # Next row to write
+        self.count = 0   # Rows holding data
+        self.appends = 0  # Total frames appended, to tell when a trend needs redrawing
+
+        self._cells = slice(len(MAIN_PAGE_FIELDS), len(MAIN_PAGE_FIELDS) + num_modules * cells_per_module)
+        self._temps = slice(self._cells.stop, self._cells.stop + num_modules * temps_per_module)
+        self._summary = slice(self._temps.stop, self._temps.stop + len(MODULE_SUMMARY_FIELDS) * num_modules)
+
+    def append(self, pack: PackState) -> None:
+        row = self.values[self.head]
+        for i, field in enumerate(MAIN_PAGE_FIELDS):
+            row[i] = pack.pack[field]
+        row[self._cells] = pack.cell_voltages.ravel()
+        row[self._temps] = pack.temps.ravel()
+        row[self._summary] = np.concatenate([getattr(pack, attr) for attr in MODULE_SUMMARY_FIELDS.values()])
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.appends += 1
+
+    def columns(self, names: Sequence[str]) -> List[int]:
+        return [self.signal_index[name] for name in names]
+
+    def decimate(self, columns: Sequence[int], width: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(positions, mins, maxs) with about one bucket per pixel of a `width` wide graph.
+
+        positions are each bucket's place on a fixed time axis, 0.0 for the
+        oldest slot in the buffer to 1.0 for the newest, so the trend scrolls
+        left as it fills. mins/maxs have one column per requested signal.
+        """
+        if not self.count:
+            empty = np.zeros((0, len(columns)), dtype=np.float32)
+            return np.zeros(0), empty, empty
+        order = (self.head - self.count + np.arange(self.count)) % self.capacity
+        history = self.values[order[:, None], np.asarray(columns, dtype=np.intp)[None, :]]
+
+        buckets = max(1, min(self.count, -(-width * self.count // self.capacity)))
+        starts = np.unique(np.arange(buckets) * self.count // buckets)
+        if len(starts) == self.count:
+            mins = maxs = history
+        else:
+            mins = np.minimum.reduceat(history, starts, axis=0)
+            maxs = np.maximum.reduceat(history, starts, axis=0)
+        positions = (self.capacity - self.count + starts) / max(1, self.capacity - 1)
+        return positions, mins, maxs
+
+
+def trend_points(positions: np.ndarray, mins: np.ndarray, maxs: np.ndarray, left: int, top: int,
+                 width: int, height: int, low: float, high: float) -> List[List[float]]:
+    """Polyline for one signal: each bucket's max then min, scaled into the graph rect"""
+    x = left + positions * (width - 1)
+    scale = (height - 1) / (high - low) if high > low else 0.0
+    y_max = top + height - 1 - (np.clip(maxs, low, high) - low) * scale
+    y_min = top + height - 1 - (np.clip(mins, low, high) - low) * scale
+    points = np.empty((2 * len(x), 2))
+    points[0::2, 0] = x
+    points[1::2, 0] = x
+    points[0::2, 1] = y_max
+    points[1::2, 1] = y_min
+    return points.tolist()